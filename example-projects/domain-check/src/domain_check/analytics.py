@@ -7,12 +7,41 @@ import posthog
 import logging
 import datetime
 import time
+import contextvars
+from types import MappingProxyType
 from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware
 
 # PostHog configuration
 analytics_enabled = False
 
+# Events are queued in-process and sent by the PostHog client's consumer thread
+# in batches of up to ANALYTICS_FLUSH_AT events, or every ANALYTICS_FLUSH_INTERVAL
+# seconds, so tracking never waits on the network in a request handler.
+ANALYTICS_QUEUE_SIZE = 10_000
+ANALYTICS_FLUSH_AT = 64
+ANALYTICS_FLUSH_INTERVAL = 2.0  # seconds
+# Batches are gzipped before upload; repetitive event JSON compresses well
+ANALYTICS_GZIP = True
+
+# Batching PostHog client, created by initialize_analytics()
+client = None
+
+# Properties shared by every event tracked while handling the current request
+_event_context = contextvars.ContextVar("analytics_event_context", default=MappingProxyType({}))
+
+def set_event_context(**properties):
+    """
+    Set properties to include with every event tracked in the current context.
+
+    Call this once at the start of a request handler for values shared by all
+    of its events, instead of repeating them in each properties dict.
+
+    Returns:
+        contextvars.Token: Token that can be used to restore the previous context
+    """
+    return _event_context.set(MappingProxyType(properties))
+
 def initialize_analytics(api_key=None, host=None):
     """
     Initialize PostHog analytics.
@@ -24,7 +53,7 @@ def initialize_analytics(api_key=None, host=None):
     Returns:
         bool: True if analytics was successfully initialized
     """
-    global analytics_enabled
+    global analytics_enabled, client
     
     # Get values from params or environment variables
     api_key = api_key or os.environ.get("POSTHOG_API_KEY", "your_api_key")
@@ -34,6 +63,16 @@ def initialize_analytics(api_key=None, host=None):
     if api_key != "your_api_key":
         posthog.api_key = api_key
         posthog.host = host
+        client = posthog.Posthog(
+            api_key,
+            host=host,
+            max_queue_size=ANALYTICS_QUEUE_SIZE,
+            flush_at=ANALYTICS_FLUSH_AT,
+            flush_interval=ANALYTICS_FLUSH_INTERVAL,
+            gzip=ANALYTICS_GZIP,
+        )
+        # Route module-level posthog.capture() calls through the same batch queue
+        posthog.default_client = client
         analytics_enabled = True
         return True
     else:
@@ -44,9 +83,10 @@ def initialize_analytics(api_key=None, host=None):
 def get_email_domain(email):
     """Extract domain from email address"""
     try:
-        return email.split('@')[1]
-    except (IndexError, AttributeError):
+        _, at, domain = email.rpartition('@')
+    except AttributeError:
         return "unknown"
+    return domain if at else "unknown"
 
 def track_event(distinct_id, event_name, properties=None):
     """
@@ -61,7 +101,11 @@ def track_event(distinct_id, event_name, properties=None):
         return
     
     try:
-        posthog.capture(
+        context = _event_context.get()
+        if context:
+            properties = {**context, **(properties or {})}
+        # Only enqueues the event; the client's consumer thread sends it in a batch
+        client.capture(
             distinct_id=distinct_id,
             event=event_name,
             properties=properties or {}
@@ -73,6 +117,9 @@ def identify_user(distinct_id, properties=None):
     """
     Identify a user in PostHog with additional properties.
     
+    The $identify message goes onto the same queue as tracked events and is
+    uploaded in the next batch, so this never makes an HTTP call inline.
+    
     Args:
         distinct_id (str): Unique identifier for the user (typically email)
         properties (dict): User properties to record
@@ -81,14 +128,28 @@ def identify_user(distinct_id, properties=None):
         return
     
     try:
-        properties['name'] = distinct_id
-        posthog.identify(
+        client.identify(
             distinct_id=distinct_id,
-            properties=properties or {}
+            properties={**(properties or {}), 'name': distinct_id}
         )
     except Exception as e:
         logging.error(f"Error identifying user in PostHog: {e}")
 
+def shutdown_analytics():
+    """
+    Send any queued events and stop the PostHog consumer thread.
+    """
+    global analytics_enabled
+    
+    if client is None:
+        return
+    
+    analytics_enabled = False
+    try:
+        client.shutdown()
+    except Exception as e:
+        logging.error(f"Error flushing PostHog events on shutdown: {e}")
+
 class AnalyticsMiddleware(BaseHTTPMiddleware):
     """
     Middleware for tracking API requests in PostHog.
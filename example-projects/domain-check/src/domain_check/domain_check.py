@@ -16,10 +16,13 @@ except ImportError:
 import ssl
 import re
 import socket
+import dns.resolver
 import datetime
 import smtplib
 import os
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from typing import List
 from dataclasses import dataclass
@@ -51,6 +54,27 @@ IPV4_OR_V6: Pattern[str] = re.compile(
 
 suffixes: Optional[set] = None
 
+# Shared DNS resolver, created on first use
+_resolver: Optional[dns.resolver.Resolver] = None
+
+# Number of DNS answers the shared resolver keeps, each for its record's TTL
+DNS_CACHE_SIZE = 10000
+
+# WHOIS queries run on their own bounded pool so a run over many unique
+# domains doesn't flood the registries' WHOIS servers
+WHOIS_MAX_CONCURRENCY = int(os.environ.get("WHOIS_MAX_CONCURRENCY", 8))
+_whois_executor = ThreadPoolExecutor(max_workers=WHOIS_MAX_CONCURRENCY, thread_name_prefix="whois")
+
+def get_resolver() -> dns.resolver.Resolver:
+    """
+    Return the module-wide DNS resolver, creating it on first use.
+    """
+    global _resolver
+    if _resolver is None:
+        _resolver = dns.resolver.Resolver()
+        _resolver.cache = dns.resolver.LRUCache(max_size=DNS_CACHE_SIZE)
+    return _resolver
+
 def is_valid_domain(domain: str) -> bool:
     """
     Check if a domain is valid by:
@@ -83,8 +107,7 @@ def is_valid_domain(domain: str) -> bool:
             pass
 
         # Check for various DNS record types using dnspython
-        import dns.resolver
-        resolver = dns.resolver.Resolver()
+        resolver = get_resolver()
         
         # Try different record types
         for record_type in ['A', 'AAAA', 'MX', 'NS']:
@@ -120,6 +143,13 @@ def is_valid_domain(domain: str) -> bool:
 #     db=initialization_result["env_vars"]["REDIS_DB"],
 #     pool_max_size=2                 
 #                  )
+# WHOIS data changes on the order of days, so keep a per-process copy for an hour
+@enhanced_cached(
+    ttl=3600,  # 1 hour
+    cache=Cache.MEMORY,
+    track_stats=True,
+    key_builder=custom_key_builder,
+)
 async def check_domain_expiry(domain: str) -> WhoisEntry:
     """
     Check the expiry date and other WHOIS information for a given domain.
@@ -192,7 +222,7 @@ async def check_domain_expiry(domain: str) -> WhoisEntry:
         if ip_match:
             domain = url
             try:
-                result = socket.gethostbyaddr(url)
+                result = await asyncio.to_thread(socket.gethostbyaddr, url)
             except socket.herror:
                 pass
             else:
@@ -203,9 +233,12 @@ async def check_domain_expiry(domain: str) -> WhoisEntry:
         # Convert to IDNA (punycode) for internationalized domains
         domain = domain.encode("idna").decode("utf-8")
 
-        # Try python-whois package for WHOIS lookup
+        # Try python-whois package for WHOIS lookup, on the WHOIS pool so concurrent
+        # checks overlap instead of blocking the event loop on the socket
         nic_client = whois.NICClient()
-        text = nic_client.whois_lookup(None, domain, flags, quiet=quiet)
+        text = await asyncio.get_running_loop().run_in_executor(
+            _whois_executor, functools.partial(nic_client.whois_lookup, None, domain, flags, quiet=quiet)
+        )
 
 
 
@@ -341,8 +374,8 @@ async def check_domains(domains_list: List[str], notification_threshold_days: in
             #     main_domain = '.'.join(domain_parts[-2:])
             #     logging.info(f"Detected subdomain. Using main domain: {main_domain}")
             #     domain = main_domain
-            # Validate domain
-            if not is_valid_domain(domain):
+            # Validate domain; the DNS lookups block, so they run in a thread
+            if not await asyncio.to_thread(is_valid_domain, domain):
                 logging.error(f"Invalid domain: {domain}")
                 if domain not in rdict:
                     edict={
@@ -63,6 +63,7 @@ def load_environment() -> Dict[str, str]:
         "APP_HOST": "0.0.0.0",
         "APP_PORT": "8000",
         "DEBUG": "False",
+        "SCHEDULER_ENABLED": "1",
     }
     
     # Add all environment variables with defaults when specified
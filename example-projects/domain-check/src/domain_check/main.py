@@ -1,10 +1,11 @@
 from fastapi import FastAPI, Request, Form, HTTPException, Cookie, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse
 import uvicorn
+import asyncio
 import os
-from typing import List, Dict, Any, Optional
+from typing import Annotated, List, Dict, Any, Optional
 import datetime
 import logging
 from pathlib import Path
@@ -14,11 +15,21 @@ from starlette.middleware.base import BaseHTTPMiddleware
 
 from pydantic import BaseModel, EmailStr, Field
 
-from .domain_check import check_domains  
+from .domain_check import check_domains, get_resolver
 from .ssl_check import SSLChecker
-from .notification_handler import NotificationHandler
-from .otp_handler import OTPHandler
+from .notification_handler import NotificationHandler, create_async_redis_client
+from .otp_handler import OTPHandler, format_created_time
 from .init_application import initialization_result
+from . import analytics
+from .analytics import (
+    AnalyticsMiddleware,
+    initialize_analytics,
+    shutdown_analytics,
+    track_event,
+    identify_user,
+    get_email_domain,
+    set_event_context,
+)
 import redis 
 # PostHog configuration
 POSTHOG_API_KEY = os.environ.get("POSTHOG_API_KEY", "your_api_key")
@@ -37,8 +48,15 @@ redis_client = redis.Redis(
                     
             )
 
-ssl_checker = SSLChecker()
-notification_handler = NotificationHandler(redis_client=redis_client)
+# Async client for the notification endpoints so Redis calls don't block the event loop
+async_redis_client = create_async_redis_client(
+                    host=initialization_result["env_vars"]["REDIS_HOST"],
+                    port=initialization_result["env_vars"]["REDIS_PORT"],
+                    password=initialization_result["env_vars"]["REDIS_PASSWORD"],
+            )
+
+ssl_checker = SSLChecker(resolver=get_resolver(), redis_client=async_redis_client)
+notification_handler = NotificationHandler(redis_client=async_redis_client)
 otp_handler = OTPHandler(redis_client=redis_client)
 
 # Keep the rest of your imports and functions
@@ -49,8 +67,19 @@ import datetime
 import os
 import logging
 from typing import List, Pattern
+from collections import Counter
 from dataclasses import dataclass
 import json
+import orjson
+
+# Splits the free-form domain input on commas and newlines
+_DOMAIN_SPLIT: Pattern[str] = re.compile(r'[,\n]')
+_URL_SCHEME: Pattern[str] = re.compile(r'^https?://')
+
+# Configuration that doesn't change after startup
+DEBUG_MODE = initialization_result["debug_mode"]
+OTP_EXPIRY_DAYS = int(initialization_result["env_vars"].get("OTP_EXPIRY_DAYS", 30))
+OTP_EXPIRES_IN = f"{OTP_EXPIRY_DAYS} days"
 
 # Configure logging
 logging.basicConfig(
@@ -60,7 +89,7 @@ logging.basicConfig(
 )
 
 # Create FastAPI app
-app = FastAPI(title="Domain Expiry Checker")
+app = FastAPI(title="Domain Expiry Checker", default_response_class=ORJSONResponse)
 
 # Set up templates directory
 templates = Jinja2Templates(directory="templates")
@@ -79,7 +108,7 @@ class DomainInfo:
 # Define Pydantic models for API requests and responses
 class DomainRegistrationRequest(BaseModel):
     email: EmailStr
-    domains: List[str] = Field(..., min_items=1, max_items=50)
+    domains: Annotated[List[str], Field(min_length=1, max_length=50)]
     otp: str  # Include OTP directly in the request
 
 class DomainUnregistrationRequest(BaseModel):
@@ -91,6 +120,8 @@ class SubscriptionResponse(BaseModel):
     status: str
     message: str
     domains: Optional[List[str]] = None
+    remaining_domains: Optional[List[str]] = None
+    notification_sent_in_background: Optional[bool] = None
     
 class OTPVerificationRequest(BaseModel):
     email: EmailStr
@@ -123,26 +154,38 @@ from multiprocessing import Process
 import time
 from .notification_scheduler import NotificationScheduler
 
-# Create and run the scheduler
-scheduler = NotificationScheduler()
+# Create and run the scheduler, sharing the app's Redis connection pool
+scheduler = NotificationScheduler(notification_handler=notification_handler, ssl_checker=ssl_checker)
+
+def persist_results(results_file: str, results: Dict[str, Any]) -> None:
+    """
+    Write the scheduled check results to a JSON file, creating its directory if needed.
+
+    Args:
+        results_file: Path of the JSON file to write
+        results: Results returned by the scheduled check
+    """
+    os.makedirs(os.path.dirname(results_file) or ".", exist_ok=True)
+    with open(results_file, 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
 async def scheduled_domain_check():
     """
     Run domain and SSL checks for all registered domains in the system.
     This function will be executed on a schedule.
     """
+    # One timestamp for every event of this run; only paid for when there is
+    # somewhere to send it
+    if analytics.analytics_enabled:
+        set_event_context(timestamp=datetime.datetime.now().isoformat())
     start_time = time.time()
     logging.info("Running scheduled domain and SSL checks")
     
     # Track start of scheduled check
     try:
-        from .analytics import track_event
         track_event(
             distinct_id='system',
-            event_name='scheduled_check_started',
-            properties={
-                'timestamp': datetime.datetime.now().isoformat()
-            }
+            event_name='scheduled_check_started'
         )
     except Exception as e:
         logging.warning(f"Failed to track scheduled check start: {e}")
@@ -159,21 +202,16 @@ async def scheduled_domain_check():
         # Save results to a JSON file for record-keeping
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         results_dir = os.environ.get("RESULTS_DIR", "results")
-        
-        # Create results directory if it doesn't exist
-        os.makedirs(results_dir, exist_ok=True)
-        
         results_file = os.path.join(results_dir, f"notification_check_{timestamp}.json")
         
-        with open(results_file, 'w') as f:
-            json.dump(results, f, indent=2)
+        # Write off the event loop so disk I/O doesn't stall other requests
+        await asyncio.to_thread(persist_results, results_file, results)
         
         logging.info(f"Results saved to {results_file}")
         print(f"Results saved to {results_file}")
 
         # Track successful completion
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id='system',
                 event_name='scheduled_check_completed',
@@ -192,7 +230,6 @@ async def scheduled_domain_check():
     except Exception as e:
         # Track error in scheduled check
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id='system',
                 event_name='scheduled_check_error',
@@ -208,7 +245,7 @@ async def scheduled_domain_check():
         logging.error(f"Error in scheduled domain check: {str(e)}")
         return {"error": str(e)}
 
-@app.post("/api/run-check", response_class=JSONResponse)
+@app.post("/api/run-check", response_class=ORJSONResponse)
 async def run_domain_check():
     """
     API endpoint to manually trigger the domain and SSL checks.
@@ -217,25 +254,103 @@ async def run_domain_check():
     try:
         results = await scheduled_domain_check()
         if results and "error" in results:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={"status": "error", "message": results["error"]}
             )
-        return JSONResponse(
+        return ORJSONResponse(
             content={"status": "success", "results": results}
         )
     except Exception as e:
         logging.error(f"Error in API domain check: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"status": "error", "message": str(e)}
         )
 
 
-def run_scheduler():
+# Only one process across all workers/replicas should run the scheduler.
+# The elected leader holds this key and keeps refreshing it while alive;
+# every other worker retries the election on the same interval.
+SCHEDULER_LEADER_KEY = "scheduler_leader"
+SCHEDULER_LEADER_TTL = 120  # seconds
+SCHEDULER_ELECTION_INTERVAL = SCHEDULER_LEADER_TTL // 2
+
+# Extend or delete the lease only while it is still held by the given worker,
+# so a paused former leader can't touch a newer leader's lease
+RENEW_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+renew_leader_script = redis_client.register_script(RENEW_LEADER_SCRIPT)
+release_leader_script = redis_client.register_script(RELEASE_LEADER_SCRIPT)
+
+# Set in the startup event for workers taking part in the election
+scheduler_worker_id: Optional[str] = None
+scheduler_process: Optional[Process] = None
+scheduler_election_task: Optional[asyncio.Task] = None
+
+def acquire_scheduler_leadership(worker_id: str) -> bool:
+    """
+    Try to become the scheduler leader using a Redis SET NX lease.
+
+    Args:
+        worker_id: Identifier stored as the lease owner
+
+    Returns:
+        bool: True if this worker should run the scheduler
+    """
+    try:
+        return bool(redis_client.set(SCHEDULER_LEADER_KEY, worker_id, nx=True, ex=SCHEDULER_LEADER_TTL))
+    except redis.RedisError as e:
+        # Without Redis there is no way to coordinate; don't risk every worker
+        # running the scheduler, the next election will try again
+        logging.warning("Scheduler leader election unavailable, not starting scheduler: %s", e)
+        return False
+
+def renew_scheduler_leadership(worker_id: str) -> bool:
+    """
+    Extend the scheduler leader lease if this worker still owns it.
+
+    Args:
+        worker_id: Identifier stored as the lease owner
+
+    Returns:
+        bool: True if the lease was extended, False if another worker owns it
+
+    Raises:
+        redis.RedisError: If Redis could not be reached
+    """
+    return bool(renew_leader_script(keys=[SCHEDULER_LEADER_KEY], args=[worker_id, SCHEDULER_LEADER_TTL * 1000]))
+
+def release_scheduler_leadership(worker_id: str) -> None:
+    """
+    Delete the scheduler leader lease if this worker still owns it, so another
+    worker can take over without waiting for the lease to expire.
+
+    Args:
+        worker_id: Identifier stored as the lease owner
+    """
+    try:
+        release_leader_script(keys=[SCHEDULER_LEADER_KEY], args=[worker_id])
+    except redis.RedisError as e:
+        logging.warning("Failed to release scheduler leader lease: %s", e)
+
+def run_scheduler(worker_id: str):
     """
     Start the background scheduler in a separate process.
     This function starts a scheduler that runs every day at 2 AM.
+
+    Args:
+        worker_id: Owner of the scheduler leader lease, renewed while the scheduler runs
     """
     while True:
 
@@ -254,36 +369,75 @@ def run_scheduler():
         scheduler.start()
         logging.info("Background scheduler started for domain checks")
         
+        last_renewed = time.monotonic()
         try:
-            # Keep the process alive
+            # Keep the process alive and renew the leader lease well before it expires
             while True:
-                time.sleep(3600)  # Sleep for 1 hour
+                time.sleep(SCHEDULER_ELECTION_INTERVAL)
+                try:
+                    if not renew_scheduler_leadership(worker_id):
+                        logging.warning("Scheduler leader lease is held by another worker, stopping scheduler")
+                        break
+                    last_renewed = time.monotonic()
+                except redis.RedisError as e:
+                    logging.warning("Failed to renew scheduler leader lease: %s", e)
+                    # Once the lease has run out another worker may be elected
+                    if time.monotonic() - last_renewed >= SCHEDULER_LEADER_TTL:
+                        logging.warning("Scheduler leader lease expired, stopping scheduler")
+                        break
         except (KeyboardInterrupt, SystemExit):
             scheduler.shutdown()
             logging.info("Background scheduler stopped")
             continue
 
+        scheduler.shutdown()
+        logging.info("Background scheduler stopped")
+        return
+
 # Start the scheduler in a separate process when the application starts
-def start_background_scheduler():
+def start_background_scheduler(worker_id: str):
     """
     Start the background scheduler in a separate process.
     """
-    process = Process(target=run_scheduler)
+    process = Process(target=run_scheduler, args=(worker_id,))
     process.daemon = True  # Daemonize to ensure it exits when the main process exits
     process.start()
     logging.info(f"Background scheduler started in process {process.pid}")
     return process
 
+async def scheduler_election_loop(worker_id: str):
+    """
+    Start the scheduler whenever this worker wins the leader election.
+
+    The election is retried every SCHEDULER_ELECTION_INTERVAL seconds while no
+    scheduler process is running here, so a follower takes over once the
+    leader's lease is released or expires.
+
+    Args:
+        worker_id: Identifier stored as the lease owner
+    """
+    global scheduler_process
+    while True:
+        if scheduler_process is None or not scheduler_process.is_alive():
+            if await asyncio.to_thread(acquire_scheduler_leadership, worker_id):
+                scheduler_process = start_background_scheduler(worker_id)
+            else:
+                logging.debug("Another worker holds the scheduler lease, retrying in %ss", SCHEDULER_ELECTION_INTERVAL)
+        await asyncio.sleep(SCHEDULER_ELECTION_INTERVAL)
+
 # Add this to the startup events for the FastAPI app
 @app.on_event("startup")
 async def startup_event():
+    global scheduler_worker_id, scheduler_election_task
     logging.info("Starting up the application")
-    start_background_scheduler()
+
+    # Set SCHEDULER_ENABLED=0 on replicas that should only serve requests
+    if initialization_result["env_vars"]["SCHEDULER_ENABLED"] == "1":
+        scheduler_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        scheduler_election_task = asyncio.create_task(scheduler_election_loop(scheduler_worker_id))
     
     # Initialize PostHog analytics with values from initialization_result
     try:
-        from .analytics import initialize_analytics, track_event
-        
         # Get PostHog config from initialization_result
         posthog_api_key = initialization_result.get("env_vars", {}).get("POSTHOG_API_KEY")
         posthog_host = initialization_result.get("env_vars", {}).get("POSTHOG_HOST")
@@ -308,15 +462,58 @@ async def startup_event():
     except Exception as e:
         logging.warning(f"Failed to initialize analytics: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    logging.info("Shutting down the application")
+    # Stop the scheduler before giving up its lease so two never overlap
+    if scheduler_election_task is not None:
+        scheduler_election_task.cancel()
+    if scheduler_process is not None and scheduler_process.is_alive():
+        scheduler_process.terminate()
+        await asyncio.to_thread(scheduler_process.join, 10)
+    if scheduler_worker_id is not None:
+        await asyncio.to_thread(release_scheduler_leadership, scheduler_worker_id)
+    # Send any analytics events still waiting in the batch queue
+    await asyncio.to_thread(shutdown_analytics)
+    # Release the pooled notification Redis connections
+    await async_redis_client.aclose()
+    # Log out of the SMTP server kept connected for OTP emails
+    await asyncio.to_thread(otp_handler.close)
+
 # Register the analytics middleware
 try:
-    from .analytics import AnalyticsMiddleware
     app.add_middleware(AnalyticsMiddleware)
     logging.info("Analytics middleware registered")
 except Exception as e:
     logging.warning(f"Failed to register analytics middleware: {e}")
 
 
+def parse_domains_input(domains: str) -> List[str]:
+    """
+    Split the raw form input into a list of unique, normalized domain names.
+
+    Domains are lower-cased and stripped of any http(s):// scheme and trailing
+    slash so pasted URLs and case variants don't trigger duplicate lookups.
+    The order of first appearance is preserved.
+    """
+    domains_list = []
+    seen = set()
+    for domain in _DOMAIN_SPLIT.split(domains):
+        domain = _URL_SCHEME.sub('', domain.strip().lower()).rstrip('/')
+        if domain and domain not in seen:
+            seen.add(domain)
+            domains_list.append(domain)
+    return domains_list
+
+def _safe_track(distinct_id: str, event_name: str, **properties) -> None:
+    """
+    Track an analytics event, logging instead of raising if tracking fails.
+    """
+    try:
+        track_event(distinct_id=distinct_id, event_name=event_name, properties=properties)
+    except Exception as e:
+        logging.warning(f"Failed to track {event_name}: {e}")
+
 # Create new functions for the FastAPI routes
 @app.get("/", response_class=HTMLResponse)
 async def get_form(request: Request):
@@ -331,16 +528,12 @@ async def get_form(request: Request):
 @app.post("/check-domains", response_class=HTMLResponse)
 async def check_domains_form(request: Request, domains: str = Form(...), threshold: int = Form(30)):
     # Parse domains from input (support both comma-separated and newline-separated)
-    domains_list = []
-    for domain in re.split(r'[,\n]', domains):
-        domain = domain.strip()
-        if domain:
-            domains_list.append(domain)
+    domains_list = parse_domains_input(domains)
     
-    posthog.capture(
-        'anonymous',  # We don't have user email in this endpoint
-        'domain_check',
-        {
+    track_event(
+        distinct_id='anonymous',  # We don't have user email in this endpoint
+        event_name='domain_check',
+        properties={
             'domain_count': len(domains_list),
             'threshold_days': threshold,
             'domains': domains_list  # List of domains being checked
@@ -350,20 +543,16 @@ async def check_domains_form(request: Request, domains: str = Form(...), thresho
     # Process domains and collect results
     results = await check_domains(domains_list, threshold)
 
-    # Track results
-    valid_count = len(results)
-    # Count domains by status
-    warning_count = sum(1 for r in results if r.get('days_left') is not None and 0 <= r.get('days_left') < 30 )
-    valid_count = sum(1 for r in results if r.get('status') == "Valid domain")
-    warning_count = sum(1 for r in results if r.get('status') == "Expiring soon!")
-    expired_count = sum(1 for r in results if r.get('status') != "Invalid domain" or r.get('status') == "Expired" or r.get('status') == "Expiring today!")
-
-    
+    # Track results: count domains by status in a single pass
+    status_counts = Counter(r.get('status') for r in results)
+    valid_count = status_counts["Valid domain"]
+    warning_count = status_counts["Expiring soon!"]
+    expired_count = status_counts["Expired"] + status_counts["Expiring today!"]
 
-    posthog.capture(
-        'anonymous',
-        'domain_check_results',
-        {
+    track_event(
+        distinct_id='anonymous',
+        event_name='domain_check_results',
+        properties={
             'domain_count': len(domains_list),
             'expired_count': expired_count,
             'warning_count': warning_count,
@@ -383,15 +572,10 @@ async def check_domains_form(request: Request, domains: str = Form(...), thresho
 @app.post("/check-ssl", response_class=HTMLResponse)
 async def check_ssl_form(request: Request, domains: str = Form(...), threshold: int = Form(30)):
     # Parse domains from input (support both comma-separated and newline-separated)
-    domains_list = []
-    for domain in re.split(r'[,\n]', domains):
-        domain = domain.strip()
-        if domain:
-            domains_list.append(domain)
+    domains_list = parse_domains_input(domains)
     
     # Track SSL check request in PostHog
     try:
-        from .analytics import track_event
         track_event(
             distinct_id='anonymous',  # We don't have user email in this endpoint
             event_name='ssl_check',
@@ -412,12 +596,12 @@ async def check_ssl_form(request: Request, domains: str = Form(...), threshold:
     
     # Track results: count certificates by status
     try:
-        # Count certificates by status
-        expired_count = sum(1 for r in ssl_results if r.get('status') == "Expired" or r.get('status') == "today!")
-        warning_count = sum(1 for r in ssl_results if r.get('status') == "Expiring soon!")
-        valid_count = sum(1 for r in ssl_results if r.get('status') == "Valid SSL")
+        # Count certificates by status in a single pass
+        status_counts = Counter(r.get('status') for r in ssl_results)
+        expired_count = status_counts["Expired"] + status_counts["Expiring today!"]
+        warning_count = status_counts["Expiring soon!"]
+        valid_count = status_counts["Valid SSL"]
         
-        from .analytics import track_event
         track_event(
             distinct_id='anonymous',
             event_name='ssl_check_results',
@@ -443,7 +627,7 @@ async def check_ssl_form(request: Request, domains: str = Form(...), threshold:
     })
 
 # New notification API endpoints
-@app.post("/api/notifications/register", response_model=SubscriptionResponse)
+@app.post("/api/notifications/register", response_model=SubscriptionResponse, response_model_exclude_none=True)
 async def register_domain_notifications(request: DomainRegistrationRequest):
     """
     Register domains for notification emails.
@@ -452,16 +636,14 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
     
     Requires OTP passed directly in the request for verification.
     """
+    if analytics.analytics_enabled:
+        set_event_context(domain_count=len(request.domains), domains=request.domains)
+
     # Start tracking this operation in PostHog
     try:
-        from .analytics import track_event
         track_event(
             distinct_id=request.email,
-            event_name='domain_registration_started',
-            properties={
-                'domain_count': len(request.domains),
-                'domains': request.domains
-            }
+            event_name='domain_registration_started'
         )
     except Exception as e:
         logging.warning(f"Failed to track domain registration start: {e}")
@@ -470,19 +652,17 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
     if not request.otp:
         # Track missing OTP
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=request.email,
                 event_name='domain_registration_error',
                 properties={
-                    'error_type': 'missing_otp',
-                    'domain_count': len(request.domains)
+                    'error_type': 'missing_otp'
                 }
             )
         except Exception as e:
             logging.warning(f"Failed to track missing OTP error: {e}")
             
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": "Verification code required. Please provide a verification code.",
             "require_otp": True
@@ -494,7 +674,6 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
 
     # Track OTP verification step
     try:
-        from .analytics import track_event
         track_event(
             distinct_id=request.email,
             event_name='otp_verification_attempted',
@@ -510,7 +689,6 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
     if not success:
         # Track failed verification
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=request.email,
                 event_name='domain_registration_error',
@@ -522,7 +700,7 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
         except Exception as e:
             logging.warning(f"Failed to track failed verification: {e}")
             
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": f"Verification failed: {message}",
             "require_otp": True
@@ -530,18 +708,15 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
     
     try:
         # Process the registration
-        result = notification_handler.register_domains(request.email, request.domains)
+        result = await notification_handler.register_domains(request.email, request.domains)
         
         # Track successful registration
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=request.email,
                 event_name='domain_registration_completed',
                 properties={
-                    'domain_count': len(request.domains),
-                    'success': result.get('status') == 'success',
-                    'domains': request.domains
+                    'success': result.get('status') == 'success'
                 }
             )
         except Exception as e:
@@ -550,25 +725,23 @@ async def register_domain_notifications(request: DomainRegistrationRequest):
         # Reset the OTP after successful registration
         #otp_handler.reset_otp(request.email)
         
-        return JSONResponse(content=result)
+        return result
     except Exception as e:
         # Track registration exception
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=request.email,
                 event_name='domain_registration_error',
                 properties={
                     'error_type': 'registration_exception',
-                    'error_message': str(e),
-                    'domains': request.domains
+                    'error_message': str(e)
                 }
             )
         except Exception as analytics_error:
             logging.warning(f"Failed to track registration exception: {analytics_error}")
             
         logging.error(f"Error registering domains: {str(e)}")
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": f"Failed to register domains: {str(e)}"
         }, status_code=500)
@@ -580,15 +753,13 @@ async def get_registered_domains(email: str, otp: str = None):
     
     Requires OTP passed as a query parameter for verification.
     """
+    if analytics.analytics_enabled:
+        set_event_context(timestamp=datetime.datetime.now().isoformat())
     # Track domain retrieval request in PostHog
     try:
-        from .analytics import track_event
         track_event(
             distinct_id=email,
-            event_name='domain_retrieval_started',
-            properties={
-                'timestamp': datetime.datetime.now().isoformat()
-            }
+            event_name='domain_retrieval_started'
         )
     except Exception as e:
         logging.warning(f"Failed to track domain retrieval start: {e}")
@@ -597,19 +768,17 @@ async def get_registered_domains(email: str, otp: str = None):
     if not otp:
         # Track missing OTP error
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=email,
                 event_name='domain_retrieval_error',
                 properties={
-                    'error_type': 'missing_otp',
-                    'timestamp': datetime.datetime.now().isoformat()
+                    'error_type': 'missing_otp'
                 }
             )
         except Exception as e:
             logging.warning(f"Failed to track domain retrieval error (missing OTP): {e}")
             
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": "Verification code required. Please provide a verification code.",
             "require_otp": True
@@ -621,7 +790,6 @@ async def get_registered_domains(email: str, otp: str = None):
     
     # Track OTP verification result
     try:
-        from .analytics import track_event
         track_event(
             distinct_id=email,
             event_name='otp_verification_attempted',
@@ -637,20 +805,18 @@ async def get_registered_domains(email: str, otp: str = None):
     if not success:
         # Track verification failure
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=email,
                 event_name='domain_retrieval_error',
                 properties={
                     'error_type': 'invalid_otp',
-                    'message': message,
-                    'timestamp': datetime.datetime.now().isoformat()
+                    'message': message
                 }
             )
         except Exception as e:
             logging.warning(f"Failed to track domain retrieval error (invalid OTP): {e}")
             
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": f"Verification failed: {message}",
             "require_otp": True
@@ -658,7 +824,7 @@ async def get_registered_domains(email: str, otp: str = None):
     
     # Verify operation matches
     # if operation != "view":
-    #     return JSONResponse(content={
+    #     return ORJSONResponse(content={
     #         "status": "error",
     #         "message": "This verification code cannot be used for viewing domains.",
     #         "require_otp": True
@@ -666,18 +832,16 @@ async def get_registered_domains(email: str, otp: str = None):
     
     try:
         # Get the domains
-        domains = notification_handler.get_domains(email)
+        domains = await notification_handler.get_domains(email)
         
         # Track successful domain retrieval
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=email,
                 event_name='domain_retrieval_completed',
                 properties={
                     'domain_count': len(domains),
-                    'has_domains': len(domains) > 0,
-                    'timestamp': datetime.datetime.now().isoformat()
+                    'has_domains': len(domains) > 0
                 }
             )
         except Exception as e:
@@ -690,26 +854,24 @@ async def get_registered_domains(email: str, otp: str = None):
     except Exception as e:
         # Track domain retrieval exception
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=email,
                 event_name='domain_retrieval_error',
                 properties={
                     'error_type': 'retrieval_exception',
-                    'error_message': str(e),
-                    'timestamp': datetime.datetime.now().isoformat()
+                    'error_message': str(e)
                 }
             )
         except Exception as analytics_error:
             logging.warning(f"Failed to track domain retrieval exception: {analytics_error}")
         
         logging.error(f"Error retrieving domains for {email}: {str(e)}")
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": f"Failed to retrieve domains: {str(e)}"
         }, status_code=500)
 
-@app.post("/api/notifications/unregister", response_model=SubscriptionResponse)
+@app.post("/api/notifications/unregister", response_model=SubscriptionResponse, response_model_exclude_none=True)
 async def unregister_domain_notifications(request: DomainUnregistrationRequest):
     """
     Unregister domains from notification service.
@@ -718,17 +880,19 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
     
     Requires OTP verification to ensure only authorized users can unregister domains.
     """
+    if analytics.analytics_enabled:
+        set_event_context(
+            domain_count=len(request.domains) if request.domains else 0,
+            timestamp=datetime.datetime.now().isoformat()
+        )
     # Track domain unregistration attempt
     try:
-        from .analytics import track_event
         track_event(
             distinct_id=request.email,
             event_name='domain_unregistration_started',
             properties={
-                'domain_count': len(request.domains) if request.domains else 0,
                 'domains': request.domains,
-                'unregister_all': request.domains is None or len(request.domains) == 0,
-                'timestamp': datetime.datetime.now().isoformat()
+                'unregister_all': request.domains is None or len(request.domains) == 0
             }
         )
     except Exception as e:
@@ -739,20 +903,17 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
         if not request.otp:
             # Track missing OTP error
             try:
-                from .analytics import track_event
                 track_event(
                     distinct_id=request.email,
                     event_name='domain_unregistration_error',
                     properties={
-                        'error_type': 'missing_otp',
-                        'domain_count': len(request.domains) if request.domains else 0,
-                        'timestamp': datetime.datetime.now().isoformat()
+                        'error_type': 'missing_otp'
                     }
                 )
             except Exception as e:
                 logging.warning(f"Failed to track missing OTP error: {e}")
                 
-            return JSONResponse(content={
+            return ORJSONResponse(content={
                 "status": "error",
                 "message": "Verification code required. Please provide a verification code to unregister domains.",
                 "require_otp": True
@@ -764,7 +925,6 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
         
         # Track OTP verification attempt
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=request.email,
                 event_name='otp_verification_attempted',
@@ -780,20 +940,18 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
         if not success:
             # Track failed verification
             try:
-                from .analytics import track_event
                 track_event(
                     distinct_id=request.email,
                     event_name='domain_unregistration_error',
                     properties={
                         'error_type': 'invalid_otp',
-                        'message': message,
-                        'timestamp': datetime.datetime.now().isoformat()
+                        'message': message
                     }
                 )
             except Exception as e:
                 logging.warning(f"Failed to track failed verification: {e}")
                 
-            return JSONResponse(content={
+            return ORJSONResponse(content={
                 "status": "error",
                 "message": f"Verification failed: {message}",
                 "require_otp": True
@@ -801,20 +959,17 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
         
         try:
             # Process the unregistration
-            result = notification_handler.unregister_domains(request.email, request.domains)
+            result = await notification_handler.unregister_domains(request.email, request.domains)
             
             # Track successful unregistration
             try:
-                from .analytics import track_event
                 track_event(
                     distinct_id=request.email,
                     event_name='domain_unregistration_completed',
                     properties={
-                        'domain_count': len(request.domains) if request.domains else 0,
                         'unregistered_count': len(result.get("domains", [])) if "domains" in result else 0,
                         'unregister_all': request.domains is None or len(request.domains) == 0,
-                        'success': result.get('status') == 'success',
-                        'timestamp': datetime.datetime.now().isoformat()
+                        'success': result.get('status') == 'success'
                     }
                 )
             except Exception as e:
@@ -823,20 +978,17 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
             # Reset the OTP after successful unregistration
             #otp_handler.reset_otp(request.email)
             
-            return JSONResponse(content=result)
+            return result
         except Exception as domain_error:
             # Track domain unregistration failure
             try:
-                from .analytics import track_event
                 track_event(
                     distinct_id=request.email,
                     event_name='domain_unregistration_error',
                     properties={
                         'error_type': 'unregistration_exception',
                         'error_message': str(domain_error),
-                        'domain_count': len(request.domains) if request.domains else 0,
-                        'domains': request.domains,
-                        'timestamp': datetime.datetime.now().isoformat()
+                        'domains': request.domains
                     }
                 )
             except Exception as analytics_error:
@@ -844,7 +996,7 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
             
             # Log and handle domain unregistration errors
             logging.error(f"Error unregistering domains for {request.email}: {str(domain_error)}")
-            return JSONResponse(content={
+            return ORJSONResponse(content={
                 "status": "error",
                 "message": f"Failed to unregister domains: {str(domain_error)}"
             }, status_code=500)
@@ -852,24 +1004,21 @@ async def unregister_domain_notifications(request: DomainUnregistrationRequest):
     except Exception as e:
         # Track general error
         try:
-            from .analytics import track_event
             track_event(
                 distinct_id=request.email,
                 event_name='domain_unregistration_error',
                 properties={
                     'error_type': 'general_exception',
-                    'error_message': str(e),
-                    'timestamp': datetime.datetime.now().isoformat()
+                    'error_message': str(e)
                 }
             )
         except Exception as analytics_error:
             logging.warning(f"Failed to track general unregistration error: {analytics_error}")
             
         # Log and handle general endpoint errors
-        logging.error(f"Unhandled exception in unregister_domain_notifications: {str(e)}")
-        import traceback
-        logging.error(traceback.format_exc())
-        return JSONResponse(content={
+        # logging.exception only formats the traceback if ERROR records are enabled
+        logging.exception("Unhandled exception in unregister_domain_notifications: %s", e)
+        return ORJSONResponse(content={
             "status": "error",
             "message": "An unexpected error occurred while processing your request. Please try again later."
         }, status_code=500)
@@ -880,7 +1029,7 @@ async def get_all_subscriptions():
     Get all active notification subscriptions.
     This endpoint is for administrative use only.
     """
-    subscriptions = notification_handler.get_all_subscriptions()
+    subscriptions = await notification_handler.get_all_subscriptions()
     return {"subscriptions": subscriptions, "count": len(subscriptions)}
 
 # Add after the existing API endpoints
@@ -895,17 +1044,16 @@ async def generate_otp(request: OTPGenerationRequest):
     
     If a valid unexpired OTP already exists, it won't generate a new one unless force_new=True.
     """
+    now_iso = datetime.datetime.now().isoformat() if analytics.analytics_enabled else None
     try:
         # Track OTP generation request in PostHog
         try:
-            from .analytics import track_event, identify_user, get_email_domain
-            
             # Identify user with email domain for demographic analysis
             identify_user(
                 distinct_id=request.email,
                 properties={
                     'email_domain': get_email_domain(request.email),
-                    'first_seen_at': datetime.datetime.now().isoformat(),
+                    'first_seen_at': now_iso,
                     'last_operation': request.operation
                 }
             )
@@ -919,118 +1067,68 @@ async def generate_otp(request: OTPGenerationRequest):
         otp, created_time, is_new = otp_handler.generate_otp(request.email, request.operation, force_new)
         
         # Track OTP generation in PostHog
-        try:
-            from .analytics import track_event
-            track_event(
-                distinct_id=request.email,
-                event_name='otp_generated',
-                properties={
-                    'operation': request.operation,
-                    'force_new': force_new,
-                    'is_new_otp': is_new
-                }
-            )
-        except Exception as e:
-            logging.warning(f"Failed to track OTP generation: {e}")
+        _safe_track(request.email, 'otp_generated', operation=request.operation, force_new=force_new, is_new_otp=is_new)
         
         # Only send email if we generated a new OTP or specifically requested resend
         if is_new or force_new:
             # Send the OTP email
-            email_sent = otp_handler.send_otp_email(request.email, otp, request.operation, created_time)
+            # SMTP is blocking, so send from a worker thread to keep the event loop free
+            email_sent = await asyncio.to_thread(
+                otp_handler.send_otp_email, request.email, otp, request.operation, created_time
+            )
             
             # Track email delivery attempt
-            try:
-                from .analytics import track_event
-                track_event(
-                    distinct_id=request.email,
-                    event_name='otp_email_sent',
-                    properties={
-                        'success': email_sent,
-                        'operation': request.operation
-                    }
-                )
-            except Exception as e:
-                logging.warning(f"Failed to track OTP email sending: {e}")
+            _safe_track(request.email, 'otp_email_sent', success=email_sent, operation=request.operation)
             
             if email_sent:
                 # Format creation time for display
-                creation_date = datetime.datetime.fromisoformat(created_time).strftime("%Y-%m-%d %H:%M:%S")
-                expiry_days = int(initialization_result["env_vars"].get("OTP_EXPIRY_DAYS", 30))
-                
+                creation_date = format_created_time(created_time)
                 # In production, don't include the OTP in the response
                 # For development/testing, we'll include it to make testing easier
-                debug_info = f" For testing: {otp}" if initialization_result["debug_mode"] else ""
+                debug_info = f" For testing: {otp}" if DEBUG_MODE else ""
                 
                 # Track in funnel: OTP generated → Email sent
-                try:
-                    from .analytics import track_event
-                    track_event(
-                        distinct_id=request.email,
-                        event_name='otp_flow_email_delivered',
-                        properties={
-                            'operation': request.operation
-                        }
-                    )
-                except Exception as e:
-                    logging.warning(f"Failed to track OTP flow: {e}")
+                _safe_track(request.email, 'otp_flow_email_delivered', operation=request.operation)
                 
-                return JSONResponse(content={
+                return ORJSONResponse(content={
                     "status": "success",
                     "message": f"Verification code has been sent to {request.email}.{debug_info} Please check your email and enter the code to continue.",
                     "email": request.email,
                     "created_at": creation_date,
-                    "expires_in": f"{expiry_days} days"
+                    "expires_in": OTP_EXPIRES_IN
                 })
             else:
                 # Track email failure
-                try:
-                    from .analytics import track_event
-                    track_event(
-                        distinct_id=request.email,
-                        event_name='otp_email_failed',
-                        properties={
-                            'operation': request.operation
-                        }
-                    )
-                except Exception as e:
-                    logging.warning(f"Failed to track OTP email failure: {e}")
+                _safe_track(request.email, 'otp_email_failed', operation=request.operation)
                 
-                return JSONResponse(content={
+                return ORJSONResponse(content={
                     "status": "warning",
                     "message": f"OTP generated, but there was an issue sending the email. Please try again or contact support.",
                     "email": request.email
                 })
         else:
             # Return existing OTP info without sending a new email
-            creation_date = datetime.datetime.fromisoformat(created_time).strftime("%Y-%m-%d %H:%M:%S")
-            expiry_days = int(initialization_result["env_vars"].get("OTP_EXPIRY_DAYS", 30))
-            
-            return JSONResponse(content={
+            creation_date = format_created_time(created_time)
+            return ORJSONResponse(content={
                 "status": "info",
-                "message": f"A verification code was already sent to {request.email} on {creation_date}. It remains valid for {expiry_days} days. Please check your email or request a new code if needed.",
+                "message": f"A verification code was already sent to {request.email} on {creation_date}. It remains valid for {OTP_EXPIRES_IN}. Please check your email or request a new code if needed.",
                 "email": request.email,
                 "created_at": creation_date,
-                "expires_in": f"{expiry_days} days",
+                "expires_in": OTP_EXPIRES_IN,
                 "existing_code": True
             })
     except Exception as e:
         # Track exception in PostHog
-        try:
-            from .analytics import track_event
-            track_event(
-                distinct_id=request.email,
-                event_name='error',
-                properties={
-                    'error_type': 'otp_generation_error',
-                    'error_message': str(e),
-                    'endpoint': '/api/otp/generate'
-                }
-            )
-        except Exception as analytics_error:
-            logging.warning(f"Failed to track OTP generation error: {analytics_error}")
-            
+        _safe_track(
+            request.email,
+            'error',
+            error_type='otp_generation_error',
+            error_message=str(e),
+            endpoint='/api/otp/generate'
+        )
+        
         logging.error(f"Error generating OTP: {e}")
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": "Failed to generate OTP",
             "email": request.email
@@ -1045,33 +1143,33 @@ async def verify_otp(request: OTPVerificationRequest, response: Response):
     If verified, the user can proceed with domain registration or viewing.
     """
     try:
-        # Verify the OTP
-        from .analytics import track_event, identify_user, get_email_domain
-        identify_user(
+        # Queue the identify call; it is sent with the next analytics batch
+        if analytics.analytics_enabled:
+            identify_user(
                 distinct_id=request.email,
                 properties={
                     'email_domain': get_email_domain(request.email),
-                    'first_seen_at': datetime.datetime.now().isoformat(),
-                    'last_operation': request.operation
+                    'first_seen_at': datetime.datetime.now().isoformat()
                 }
             )
 
+        # Verify the OTP
         success, message = otp_handler.verify_otp(request.email, request.otp)
         logging.info(f"OTP verification for {request.email}: {success}, message: {message}")
         if success:
             # Set a cookie to indicate the user is verified for the operation
-            return JSONResponse(content={
+            return ORJSONResponse(content={
                 "status": "success",
                 "message": message
             })
         else:
-            return JSONResponse(content={
+            return ORJSONResponse(content={
                 "status": "error",
                 "message": message
             }, status_code=400)
     except Exception as e:
         logging.error(f"Error verifying OTP: {e}")
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "status": "error",
             "message": "Failed to verify OTP"
         }, status_code=500)
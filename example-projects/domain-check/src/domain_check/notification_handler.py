@@ -1,27 +1,93 @@
 import os
+import atexit
+import functools
 import hashlib
 import logging
+import logging.handlers
+import queue
+import asyncio
 import redis
-import threading
-from typing import List, Dict, Optional, Any, Union
+import redis.asyncio as redis_async
+from typing import AsyncIterator, List, Dict, Optional, Any, Set, Union
 from fastapi import HTTPException
 
 # Import initialization module to load environment variables
 from .init_application import initialization_result
 # Import domain check and SSL checker for immediate notifications
 from .domain_check import check_domains
-from .ssl_check import SSLChecker
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='notification_handler.log'
+# Configure logging so request handlers never wait on file writes: records go
+# onto a queue, and a listener thread buffers them in memory before writing.
+# WARNING and above are flushed to the file immediately.
+log_file = 'notification_handler.log'
+max_bytes = 50 * 1024 * 1024  # 50 MB
+backup_count = 5  # Number of backup files to keep
+
+file_handler = logging.handlers.RotatingFileHandler(
+    log_file, maxBytes=max_bytes, backupCount=backup_count
+)
+file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+memory_handler = logging.handlers.MemoryHandler(
+    capacity=256, flushLevel=logging.WARNING, target=file_handler
 )
 
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(log_queue, memory_handler)
+log_listener.start()
+
+def _stop_log_listener():
+    # Drain the queue, then write out whatever is still buffered
+    log_listener.stop()
+    memory_handler.close()
+    file_handler.close()
+
+atexit.register(_stop_log_listener)
+
 logger = logging.getLogger(__name__)
-if initialization_result["debug_mode"]:
-    logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.propagate = False
+logger.setLevel(logging.DEBUG if initialization_result["debug_mode"] else logging.INFO)
+
+# Set of email hashes with an active subscription, so listing subscriptions
+# doesn't have to walk the whole keyspace
+ACTIVE_SUBSCRIPTIONS_KEY = "active_subscriptions"
+
+# Set once subscriptions stored before the index existed have been added to it
+SUBSCRIPTIONS_INDEXED_KEY = "subscriptions_indexed"
+
+# Domains registered for an email are kept in a SET at "domains:<email_hash>"
+DOMAINS_KEY_PREFIX = "domains:"
+
+# Replies are left as bytes (no decode_responses) and only the values returned
+# to callers are decoded, so these are compared against raw reply values
+ACTIVE_STATUS = b"active"
+LEGACY_DOMAINS_FIELD = b"domains"
+
+# Number of keys fetched per SCAN call / pipelined subscription read batch
+SUBSCRIPTION_BATCH_SIZE = 500
+
+# Upper bound on pooled Redis connections; callers wait for a free one past this
+REDIS_MAX_CONNECTIONS = 32
+
+def create_async_redis_client(host: str, port: int, password: Optional[str] = None) -> redis_async.Redis:
+    """
+    Create an async Redis client backed by a blocking connection pool.
+    
+    Args:
+        host: Redis server hostname
+        port: Redis server port
+        password: Redis server password (optional)
+        
+    Returns:
+        redis.asyncio.Redis client sharing one pool across requests
+    """
+    pool = redis_async.BlockingConnectionPool(
+        host=host,
+        port=int(port),
+        password=password,
+        max_connections=REDIS_MAX_CONNECTIONS
+    )
+    return redis_async.Redis(connection_pool=pool)
 
 class NotificationHandler:
     """
@@ -32,48 +98,43 @@ class NotificationHandler:
     Google Cloud Memorystore for Redis.
     """
     
-    def __init__(self,redis_client: Optional[redis.Redis] = None):
+    def __init__(self, redis_client: Optional[redis_async.Redis] = None):
         """
-        Initialize the Redis connection using environment variables.
+        Initialize the async Redis client using environment variables.
+        
+        The client is backed by a connection pool that is opened lazily, so the
+        application can start even if Redis is not available yet.
         
         Environment Variables:
             REDIS_HOST: Redis server hostname (defaults to localhost)
             REDIS_PORT: Redis server port (defaults to 6379)
             REDIS_PASSWORD: Redis server password (optional)
         """
-        try:
-            # If a Redis client is provided, use it; otherwise, create a new one
-            if not redis_client:
-                # Get Redis connection info from environment variables
-                redis_host = os.environ.get("REDIS_HOST", "localhost")
-                redis_port = int(os.environ.get("REDIS_PORT", 6379))
-                redis_password = os.environ.get("REDIS_PASSWORD", None)
-                
-                logger.info(f"Connecting to Redis at {redis_host}:{redis_port}")
-                
-                # Create Redis connection
-                self.redis_client = redis.Redis(
-                    host=redis_host,
-                    port=redis_port,
-                    password=redis_password,
-                    decode_responses=True
-                )
-                logger.info(f"Successfully connected to Redis at {redis_host}:{redis_port}")
-                # Test the connection
-            else:
-                self.redis_client= redis_client    
-            self.redis_client.ping()
-            logger.info(f"Successfully connected to Redis ")
-
+        # If a Redis client is provided, use it; otherwise, create a new one
+        if not redis_client:
+            # Get Redis connection info from environment variables
+            redis_host = os.environ.get("REDIS_HOST", "localhost")
+            redis_port = int(os.environ.get("REDIS_PORT", 6379))
+            redis_password = os.environ.get("REDIS_PASSWORD", None)
+            
+            logger.info(f"Using Redis at {redis_host}:{redis_port}")
             
-        except redis.ConnectionError as e:
-            logger.error(f"Failed to connect to Redis: {e}")
-            # Don't raise exception here, allow the application to start
-            # even if Redis is not available
+            redis_client = create_async_redis_client(redis_host, redis_port, redis_password)
+        self.redis_client = redis_client
+        
+        # Keep references to background notification tasks so they aren't
+        # garbage collected before they finish
+        self._background_tasks = set()
+        
+        # Whether the subscription index is known to include older subscriptions
+        self._subscriptions_indexed = False
     
-    def _hash_email(self, email: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _hash_email(email: str) -> str:
         """
         Create a hash of the email address to use as the Redis key.
+        Results are memoized since the same addresses are hashed on every request.
         
         Args:
             email: The email address to hash
@@ -83,7 +144,44 @@ class NotificationHandler:
         """
         return hashlib.sha256(email.encode()).hexdigest()
     
-    def register_domains(self, email: str, domains: List[str]) -> Dict[str, Any]:
+    def _domains_key(self, email_hash: Union[str, bytes]) -> Union[str, bytes]:
+        """
+        Get the Redis key of the SET holding the domains registered for an email hash.
+        Email hashes read back from the subscription index are bytes.
+        """
+        if isinstance(email_hash, bytes):
+            return DOMAINS_KEY_PREFIX.encode() + email_hash
+        return f"{DOMAINS_KEY_PREFIX}{email_hash}"
+    
+    @staticmethod
+    def _decode_domains(domains: Set[bytes]) -> List[str]:
+        """
+        Decode the members of a domain SET into a sorted list of domain names.
+        """
+        return sorted(domain.decode() for domain in domains)
+    
+    async def _migrate_legacy_domains(self, email_hash: Union[str, bytes], domains_str: bytes) -> Set[bytes]:
+        """
+        Move domains stored in the old comma-separated "domains" hash field into the domain SET.
+        
+        Args:
+            email_hash: Hash of the subscription email
+            domains_str: Value of the legacy "domains" field
+            
+        Returns:
+            All domains in the SET after the migration
+        """
+        domains_key = self._domains_key(email_hash)
+        legacy_domains = [d for d in domains_str.split(b",") if d]
+        
+        pipe = self.redis_client.pipeline()
+        if legacy_domains:
+            pipe.sadd(domains_key, *legacy_domains)
+        pipe.hdel(email_hash, "domains")
+        pipe.smembers(domains_key)
+        return (await pipe.execute())[-1]
+    
+    async def register_domains(self, email: str, domains: List[str]) -> Dict[str, Any]:
         """
         Register domains for notification for a given email.
         
@@ -100,28 +198,33 @@ class NotificationHandler:
         try:
             # Create a hash of the email for the key
             email_hash = self._hash_email(email)
+            domains_key = self._domains_key(email_hash)
             
-            # Check if the email already has domains registered
-            existing_domains = self.get_domains(email)
-            
-            # Combine existing and new domains, removing duplicates
-            all_domains = list(set(existing_domains + domains))
-            
-            # Store the domains in Redis with the email hash as the key
-            # Format: key=email_hash, value={"domains": ["domain1", "domain2", ...], "status": "active"}
+            # Store the subscription in Redis with the email hash as the key
+            # Format: key=email_hash, value={"email": email, "status": "active"}
+            # and the domains in a SET at key="domains:<email_hash>"
             domain_data = {
                 "email": email,
-                "domains": all_domains,
                 "status": "active"
             }
             
-            # Store as a hash in Redis
-            for key, value in domain_data.items():
-                if isinstance(value, list):
-                    # Store lists as comma-separated strings
-                    self.redis_client.hset(email_hash, key, ",".join(value))
-                else:
-                    self.redis_client.hset(email_hash, key, value)
+            # SADD merges with any existing domains server side, so there is no
+            # read-modify-write; the whole update is one MULTI round trip
+            pipe = self.redis_client.pipeline()
+            pipe.hmget(email_hash, "status", "domains")
+            pipe.hset(email_hash, mapping=domain_data)
+            pipe.hdel(email_hash, "domains")
+            pipe.sadd(domains_key, *domains)
+            pipe.sadd(ACTIVE_SUBSCRIPTIONS_KEY, email_hash)
+            pipe.smembers(domains_key)
+            results = await pipe.execute()
+            (previous_status, legacy_domains), all_domains = results[0], results[-1]
+            
+            # Carry over domains of an active subscription stored before the SET schema
+            if previous_status == ACTIVE_STATUS and legacy_domains:
+                all_domains = await self._migrate_legacy_domains(email_hash, legacy_domains)
+            
+            all_domains = self._decode_domains(all_domains)
             
             # Determine which domains are newly added
             new_domains = all_domains
@@ -130,13 +233,12 @@ class NotificationHandler:
             if new_domains:
                 try:
                     logger.info(f"Triggering background notification check for {len(new_domains)} newly registered domains")
-                    # Start a background thread to send the notification
-                    notification_thread = threading.Thread(
-                        target=self._send_notification_in_background,
-                        args=(email, new_domains),
-                        daemon=True  # Make it a daemon thread so it won't block application shutdown
+                    # Run the notification as a task on the event loop so the response isn't held up
+                    notification_task = asyncio.create_task(
+                        self._send_notification_in_background(email, new_domains)
                     )
-                    notification_thread.start()
+                    self._background_tasks.add(notification_task)
+                    notification_task.add_done_callback(self._background_tasks.discard)
                     
                     return {
                         "status": "success",
@@ -157,7 +259,7 @@ class NotificationHandler:
             logger.error(f"Redis error while registering domains: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to register domains: {str(e)}")
     
-    def get_domains(self, email: str) -> List[str]:
+    async def get_domains(self, email: str) -> List[str]:
         """
         Get all domains registered for a given email.
         
@@ -170,26 +272,27 @@ class NotificationHandler:
         try:
             email_hash = self._hash_email(email)
             
-            # Get domain data from Redis
-            domain_data = self.redis_client.hgetall(email_hash)
-            
-            if not domain_data:
-                return []
+            # Get the subscription status and domains from Redis in one round trip,
+            # fetching only the hash fields that are needed
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hmget(email_hash, "status", LEGACY_DOMAINS_FIELD)
+            pipe.smembers(self._domains_key(email_hash))
+            (status, legacy_domains), domains = await pipe.execute()
             
-            # Check if the subscription is active
-            if domain_data.get("status") != "active":
+            # Check if the subscription exists and is active
+            if status != ACTIVE_STATUS:
                 return []
             
-            # Parse the comma-separated domains
-            domains_str = domain_data.get("domains", "")
-            domains = domains_str.split(",") if domains_str else []
+            # Subscriptions stored before the SET schema keep their domains in the hash
+            if legacy_domains is not None:
+                domains = await self._migrate_legacy_domains(email_hash, legacy_domains)
             
-            return domains
+            return self._decode_domains(domains)
         except redis.RedisError as e:
             logger.error(f"Redis error while retrieving domains: {e}")
             return []
     
-    def unregister_domains(self, email: str, domains: Optional[List[str]] = None) -> Dict[str, Any]:
+    async def unregister_domains(self, email: str, domains: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Unregister domains for notification or mark the entire subscription as inactive.
         
@@ -202,11 +305,12 @@ class NotificationHandler:
         """
         try:
             email_hash = self._hash_email(email)
+            domains_key = self._domains_key(email_hash)
             
-            # Get current domain data
-            domain_data = self.redis_client.hgetall(email_hash)
+            # Every subscription hash has a status, so a missing one means no subscription
+            status, legacy_domains = await self.redis_client.hmget(email_hash, "status", LEGACY_DOMAINS_FIELD)
             
-            if not domain_data:
+            if status is None:
                 return {
                     "status": "warning",
                     "message": f"No subscriptions found for {email}"
@@ -214,20 +318,27 @@ class NotificationHandler:
             
             # If specific domains are provided, remove only those domains
             if domains:
-                current_domains = domain_data.get("domains", "").split(",")
-                updated_domains = [d for d in current_domains if d not in domains]
+                if legacy_domains is not None:
+                    await self._migrate_legacy_domains(email_hash, legacy_domains)
                 
-                # Update Redis with the remaining domains
-                self.redis_client.hset(email_hash, "domains", ",".join(updated_domains))
+                # Remove the domains server side and read back what is left
+                pipe = self.redis_client.pipeline()
+                pipe.srem(domains_key, *domains)
+                pipe.smembers(domains_key)
+                _, updated_domains = await pipe.execute()
                 
                 return {
                     "status": "success",
                     "message": f"Unregistered {len(domains)} domains for {email}",
-                    "remaining_domains": updated_domains
+                    "remaining_domains": self._decode_domains(updated_domains)
                 }
             else:
                 # Mark the entire subscription as inactive
-                self.redis_client.hset(email_hash, "status", "inactive")
+                pipe = self.redis_client.pipeline()
+                pipe.hset(email_hash, "status", "inactive")
+                pipe.delete(domains_key)
+                pipe.srem(ACTIVE_SUBSCRIPTIONS_KEY, email_hash)
+                await pipe.execute()
                 
                 return {
                     "status": "success",
@@ -237,7 +348,7 @@ class NotificationHandler:
             logger.error(f"Redis error while unregistering domains: {e}")
             raise HTTPException(status_code=500, detail=f"Failed to unregister domains: {str(e)}")
     
-    def get_all_subscriptions(self) -> List[Dict[str, Any]]:
+    async def get_all_subscriptions(self) -> List[Dict[str, Any]]:
         """
         Get all active domain subscriptions.
         
@@ -245,28 +356,128 @@ class NotificationHandler:
             List of subscription details (email, domains, status)
         """
         try:
-            # Get all keys (email hashes)
-            all_keys = self.redis_client.keys("*")
-            subscriptions = []
-            
-            for key in all_keys:
-                subscription_data = self.redis_client.hgetall(key)
-                
-                # Only include active subscriptions
-                if subscription_data.get("status") == "active":
-                    domains_str = subscription_data.get("domains", "")
-                    subscription = {
-                        "email": subscription_data.get("email", "unknown"),
-                        "domains": domains_str.split(",") if domains_str else [],
-                        "status": "active"
-                    }
-                    subscriptions.append(subscription)
-            
-            return subscriptions
+            return [
+                subscription
+                async for page in self.iter_all_subscriptions()
+                for subscription in page
+            ]
         except redis.RedisError as e:
             logger.error(f"Redis error while retrieving all subscriptions: {e}")
             return []
     
+    async def iter_all_subscriptions(self, page_size: int = SUBSCRIPTION_BATCH_SIZE) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Get active domain subscriptions a page at a time.
+        
+        The subscription index is walked with SSCAN and each page is loaded with
+        one Redis round trip, so callers can start on a page while the next one
+        is being fetched without holding every subscription in memory.
+        
+        Args:
+            page_size: Number of subscription hashes fetched per round trip
+            
+        Yields:
+            Lists of subscription details (email, domains, status)
+            
+        Raises:
+            redis.RedisError: If a page could not be fetched
+        """
+        await self._ensure_subscriptions_indexed()
+        
+        batch = []
+        async for key in self.redis_client.sscan_iter(ACTIVE_SUBSCRIPTIONS_KEY, count=page_size):
+            batch.append(key)
+            if len(batch) >= page_size:
+                page = await self._fetch_subscription_page(batch)
+                if page:
+                    yield page
+                batch = []
+        if batch:
+            page = await self._fetch_subscription_page(batch)
+            if page:
+                yield page
+    
+    async def _fetch_subscription_page(self, batch: List[bytes]) -> List[Dict[str, Any]]:
+        """
+        Load the active subscriptions among a batch of subscription hashes.
+        
+        Args:
+            batch: Keys of the subscription hashes to load
+            
+        Returns:
+            List of subscription details (email, domains, status)
+        """
+        # Fetch a batch of hashes and their domain SETs in a single round trip
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key in batch:
+            pipe.hmget(key, "status", "email", LEGACY_DOMAINS_FIELD)
+            pipe.smembers(self._domains_key(key))
+        replies = await pipe.execute()
+        
+        page = []
+        for key, (status, email, legacy_domains), domains in zip(batch, replies[::2], replies[1::2]):
+            # Only include active subscriptions
+            if status == ACTIVE_STATUS:
+                if legacy_domains is not None:
+                    domains = await self._migrate_legacy_domains(key, legacy_domains)
+                page.append({
+                    "email": email.decode() if email else "unknown",
+                    "domains": self._decode_domains(domains),
+                    "status": "active"
+                })
+        return page
+    
+    async def _ensure_subscriptions_indexed(self) -> None:
+        """
+        Add subscriptions stored before the subscription index existed to it, once.
+        
+        The backfill runs whatever the index already holds, since subscriptions
+        registered after the upgrade are indexed while older ones aren't. A
+        marker key records that it has completed, so it never runs again.
+        
+        Raises:
+            redis.RedisError: If the index could not be checked or backfilled
+        """
+        if self._subscriptions_indexed:
+            return
+        if not await self.redis_client.exists(SUBSCRIPTIONS_INDEXED_KEY):
+            # Subscriptions stored before the index existed are found with SCAN
+            await self._index_existing_subscriptions()
+            await self.redis_client.set(SUBSCRIPTIONS_INDEXED_KEY, 1)
+        self._subscriptions_indexed = True
+    
+    async def _index_existing_subscriptions(self) -> List[bytes]:
+        """
+        Find active subscription hashes with SCAN and add them to the subscription index.
+        
+        Returns:
+            List of email hashes with an active subscription
+        """
+        active_hashes = []
+        batch = []
+        
+        async def flush(keys):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hget(key, "status")
+            for key, status in zip(keys, await pipe.execute()):
+                if status == ACTIVE_STATUS:
+                    active_hashes.append(key)
+        
+        # SCAN walks the keyspace incrementally instead of blocking Redis like KEYS
+        async for key in self.redis_client.scan_iter(count=SUBSCRIPTION_BATCH_SIZE, _type="HASH"):
+            batch.append(key)
+            if len(batch) >= SUBSCRIPTION_BATCH_SIZE:
+                await flush(batch)
+                batch = []
+        if batch:
+            await flush(batch)
+        
+        if active_hashes:
+            await self.redis_client.sadd(ACTIVE_SUBSCRIPTIONS_KEY, *active_hashes)
+            logger.info(f"Indexed {len(active_hashes)} existing subscriptions")
+        return active_hashes
+    
     async def send_immediate_notification(self, email: str, domains: List[str]) -> Dict[str, Any]:
         """
         Send an immediate domain check notification for newly registered domains.
@@ -286,23 +497,22 @@ class NotificationHandler:
             
             # We need to import here to avoid circular imports
             from .notification_scheduler import NotificationScheduler
-            scheduler = NotificationScheduler()
+            scheduler = NotificationScheduler(notification_handler=self)
             
             # Check domain expirations
             domain_results = await check_domains(domains, days_threshold)
             
-            # Check SSL certificates
-            ssl_checker = SSLChecker()
+            # Check SSL certificates with the scheduler's checker and its shared resolver
             ssl_results = []
             for domain in domains:
                 try:
-                    ssl_certificates = await ssl_checker.check_domain_certificates(domain, days_threshold)
+                    ssl_certificates = await scheduler.ssl_checker.check_domain_certificates(domain, days_threshold)
                     ssl_results.extend(ssl_certificates)
                 except Exception as e:
                     logger.error(f"Error checking SSL for {domain}: {e}")
             
             # Send notification with the results
-            notification_result = scheduler._send_notification(
+            notification_result = await scheduler._send_notification(
                 email=email,
                 expiring_domains=domain_results,
                 expiring_certs=ssl_results,
@@ -312,28 +522,24 @@ class NotificationHandler:
             logger.info(f"Immediate notification result: {notification_result}")
             return notification_result
         except Exception as e:
-            logger.error(f"Error sending immediate notification: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
+            logger.exception("Error sending immediate notification: %s", e)
             return {
                 "status": "error",
                 "message": f"Failed to send immediate notification: {str(e)}",
                 "email": email
             }
     
-    def _send_notification_in_background(self, email: str, domains: List[str]) -> None:
+    async def _send_notification_in_background(self, email: str, domains: List[str]) -> None:
         """
-        Helper method to send notifications in a background thread.
+        Helper method to send notifications in a background task.
         
         Args:
             email: Email address for notifications
             domains: List of domain names to check
         """
         try:
-            logger.info(f"Background thread: Sending notification for {len(domains)} domains to {email}")
-            notification_result = self.send_immediate_notification(email, domains)
+            logger.info(f"Background task: Sending notification for {len(domains)} domains to {email}")
+            notification_result = await self.send_immediate_notification(email, domains)
             logger.info(f"Background notification completed with status: {notification_result.get('status', 'unknown')}")
         except Exception as e:
-            logger.error(f"Error in background notification thread: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
\ No newline at end of file
+            logger.exception("Error in background notification task: %s", e)
\ No newline at end of file
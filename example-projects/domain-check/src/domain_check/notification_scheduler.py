@@ -1,17 +1,22 @@
 import os
+import asyncio
 import logging
-import smtplib
 import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import List, Dict, Any
+import aiosmtplib
+import jinja2
+import redis
+from email import policy
+from email.message import EmailMessage
+from typing import List, Dict, Any, Optional
 
 # Import initialization module to load environment variables
 from .init_application import initialization_result
 
 from .notification_handler import NotificationHandler
-from .domain_check import check_domains
+from .domain_check import check_domains, get_resolver
 from .ssl_check import SSLChecker
+from .analytics import track_event
+from .smtp_pool import SMTPPool
 
 # Configure logging
 logging.basicConfig(
@@ -24,6 +29,73 @@ logger = logging.getLogger(__name__)
 if initialization_result["debug_mode"]:
     logger.setLevel(logging.DEBUG)
 
+# Subject line of every notification email
+NOTIFICATION_SUBJECT = "ALERT: Domains and SSL Certificates Expiring Soon"
+
+# Notification email body, compiled once; autoescaping keeps registrar and
+# issuer strings from injecting markup
+NOTIFICATION_TEMPLATE = jinja2.Environment(autoescape=True, auto_reload=False).from_string("""
+            <html>
+            <head>
+                <style>
+                    body { font-family: Arial, sans-serif; line-height: 1.6; }
+                    h1, h2 { color: #333; }
+                    .expiry-alert { color: #cc0000; font-weight: bold; }
+                    table { border-collapse: collapse; width: 100%; margin: 20px 0; }
+                    th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
+                    th { background-color: #f2f2f2; }
+                    .alert { color: #cc0000; }
+                </style>
+            </head>
+            <body>
+                <h1>Domain and SSL Certificate Expiry Alert</h1>
+                <p>This is an automated notification about your domains and SSL certificates that will expire within the next {{ days_threshold }} days.</p>
+            {% if expiring_domains %}
+                <h2>Domains Expiring Soon</h2>
+                <table>
+                    <tr>
+                        <th>Domain</th>
+                        <th>Expiry Date</th>
+                        <th>Days Left</th>
+                        <th>Registrar</th>
+                    </tr>
+                {% for domain in expiring_domains %}
+                    <tr>
+                        <td>{{ domain['domain'] }}</td>
+                        <td>{{ domain['expiry_date'] }}</td>
+                        <td class="alert">{{ domain['days_left'] }}</td>
+                        <td>{{ domain['registrar'] }}</td>
+                    </tr>
+                {% endfor %}
+                </table>
+                <p>Please renew these domains soon to avoid service interruptions.</p>
+            {% endif %}
+            {% if expiring_certs %}
+                <h2>SSL Certificates Expiring Soon</h2>
+                <table>
+                    <tr>
+                        <th>Hostname</th>
+                        <th>Issuer</th>
+                        <th>Expiry Date</th>
+                        <th>Days Left</th>
+                    </tr>
+                {% for cert in expiring_certs %}
+                    <tr>
+                        <td>{{ cert['hostname'] }}</td>
+                        <td>{{ cert.get('cert_issuer', "") }}</td>
+                        <td>{{ cert.get('not_after', "") }}</td>
+                        <td class="alert">{{ cert.get('days_to_expire', -1) }}</td>
+                    </tr>
+                {% endfor %}
+                </table>
+                <p>Please renew these SSL certificates soon to avoid security warnings and connection problems.</p>
+            {% endif %}
+                <p>To manage your notification settings, visit our Domain & SSL Expiry Checker tool.</p>
+                <p>If you no longer wish to receive these notifications, you can unregister your domains.</p>
+            </body>
+            </html>
+""")
+
 class NotificationScheduler:
     """
     Scheduler for checking domain and SSL expiry dates and sending notification emails.
@@ -32,14 +104,26 @@ class NotificationScheduler:
     and sending email notifications when domains or SSL certificates are about to expire.
     """
     
-    def __init__(self):
+    def __init__(self, notification_handler: Optional[NotificationHandler] = None,
+                 ssl_checker: Optional[SSLChecker] = None):
         """
         Initialize the notification scheduler.
         
         Sets up the notification handler, SSL checker, and email configuration.
+        
+        Args:
+            notification_handler: Handler to read subscriptions with. Pass the
+                application's handler so its Redis connection pool is shared; a
+                new handler with its own pool is created if not provided.
+            ssl_checker: SSL checker to reuse. A new one sharing the handler's
+                Redis connections and the module-wide DNS resolver is created
+                if not provided.
         """
-        self.notification_handler = NotificationHandler()
-        self.ssl_checker = SSLChecker()
+        self.notification_handler = notification_handler or NotificationHandler()
+        # Share the handler's Redis connections for persisted certificate checks
+        self.ssl_checker = ssl_checker or SSLChecker(
+            resolver=get_resolver(), redis_client=self.notification_handler.redis_client
+        )
         
         # Email configuration from environment variables
         self.smtp_server = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
@@ -48,6 +132,11 @@ class NotificationScheduler:
         self.smtp_password = os.environ.get("SMTP_PASSWORD", "")
         self.from_email = os.environ.get("FROM_EMAIL", "domaincheck@example.com")
         
+        # Scheduled runs send over a pool of SMTP connections, each recycled after
+        # a number of messages to stay under provider per-connection limits
+        self.smtp_pool_size = int(os.environ.get("SMTP_POOL_SIZE", 5))
+        self.smtp_max_messages_per_connection = int(os.environ.get("SMTP_MAX_MESSAGES_PER_CONNECTION", 100))
+        
         # Log SMTP configuration (excluding password)
         logger.info(f"SMTP Server: {self.smtp_server}:{self.smtp_port}")
         logger.info(f"From Email: {self.from_email}")
@@ -66,58 +155,114 @@ class NotificationScheduler:
         """
         logging.info(f"Starting domain expiry check with threshold of {days_threshold} days")
         
-        # Get all active subscriptions
-        subscriptions = self.notification_handler.get_all_subscriptions()
-        notification_results = []
+        # Send over pooled SMTP sessions so notifications go out concurrently
+        # while the next subscription is being checked
+        smtp_pool = None
+        if self.smtp_username and self.smtp_password:
+            smtp_pool = SMTPPool(
+                self.smtp_server,
+                self.smtp_port,
+                self.smtp_username,
+                self.smtp_password,
+                pool_size=self.smtp_pool_size,
+                max_messages_per_connection=self.smtp_max_messages_per_connection
+            )
         
-        for subscription in subscriptions:
-            email = subscription["email"]
-            domains = subscription["domains"]
-            
-            # Skip if no domains registered
-            if not domains:
-                continue
-                
-            logging.info(f"Checking {len(domains)} domains for {email}")
-            
-            # Check domain expirations
-            domain_results = await check_domains(domains, days_threshold)
-            
-            # Check SSL certificates for each domain
-            ssl_results = []
-            for domain in domains:
-                ssl_certificates = await self.ssl_checker.check_domain_certificates(domain, days_threshold)
-                ssl_results.extend(ssl_certificates)
-            
-            # Filter domains that are expiring soon
-            expiring_domains = []
-            for result in domain_results:
-                if result["days_left"] < days_threshold and result["days_left"] > 0:
-                    result["status"] = "Expiring Soon"
-                    expiring_domains.append(result)
-            
-            # Filter SSL certificates that are expiring soon
-            expiring_certs = []
-            for result in ssl_results:
-                if result.get("days_to_expire", 0) < days_threshold and result.get("days_to_expire", 0) > 0:
-                    result["status"] = "Expiring Soon"
-                    expiring_certs.append(result)
+        # Check each unique domain once per run, however many subscriptions watch it;
+        # subscriptions await the shared tasks for their own domains
+        domain_checks = {}
+        ssl_checks = {}
+        notifications = []
+        
+        try:
+            # Subscriptions are loaded a page at a time; each page's checks and
+            # notifications start before the next page is fetched
+            try:
+                async for page in self.notification_handler.iter_all_subscriptions():
+                    for subscription in page:
+                        if not subscription["domains"]:  # Skip if no domains registered
+                            continue
+                        for domain in subscription["domains"]:
+                            if domain not in domain_checks:
+                                domain_checks[domain] = asyncio.ensure_future(check_domains([domain], days_threshold))
+                                ssl_checks[domain] = asyncio.ensure_future(
+                                    self.ssl_checker.check_domain_certificates(domain, days_threshold)
+                                )
+                        notifications.append(asyncio.ensure_future(self._check_and_notify_subscription(
+                            subscription, days_threshold, domain_checks, ssl_checks, smtp_pool
+                        )))
+            except redis.RedisError as e:
+                logging.error(f"Redis error while retrieving subscriptions: {e}")
             
-            # Send notification if more than 1 domain OR more than 1 SSL certificate is expiring
-            #if len(expiring_domains) > 1 or len(expiring_certs) > 1:
-            result = self._send_notification(
-                    email=email,
-                    expiring_domains=domain_results,
-                    expiring_certs=ssl_results,
-                    days_threshold=days_threshold
-                )
-            notification_results.append(result)
+            notification_results = list(await asyncio.gather(*notifications))
+        finally:
+            for task in (*notifications, *domain_checks.values(), *ssl_checks.values()):
+                task.cancel()
+            if smtp_pool is not None:
+                await smtp_pool.close()
         
         logging.info(f"Completed domain expiry checks. Sent {len(notification_results)} notifications.")
         return notification_results
         
-    def _send_notification(self, email: str, expiring_domains: List[Dict[str, Any]], 
-                          expiring_certs: List[Dict[str, Any]], days_threshold: int) -> Dict[str, Any]:
+    async def _check_and_notify_subscription(self, subscription: Dict[str, Any], days_threshold: int,
+                                             domain_checks: Dict[str, "asyncio.Future[List[Dict[str, Any]]]"],
+                                             ssl_checks: Dict[str, "asyncio.Future[List[Dict[str, Any]]]"],
+                                             smtp_pool: Optional[SMTPPool]) -> Dict[str, Any]:
+        """
+        Collect the domain and SSL certificate checks of one subscription and send its notification.
+        
+        Args:
+            subscription: Subscription details (email, domains, status)
+            days_threshold: Number of days before expiry to send notifications
+            domain_checks: Domain expiry check task for each domain in this run
+            ssl_checks: SSL certificate check task for each domain in this run
+            smtp_pool: Pool of SMTP connections, or None if SMTP isn't configured
+            
+        Returns:
+            Dict with notification status
+        """
+        email = subscription["email"]
+        domains = subscription["domains"]
+        
+        logging.info(f"Checking {len(domains)} domains for {email}")
+        
+        # Domain expirations; subdomains of one registered domain share a result
+        domain_results = []
+        checked_domains = set()
+        for results in await asyncio.gather(*(domain_checks[domain] for domain in domains)):
+            for result in results:
+                if result["domain"] not in checked_domains:
+                    checked_domains.add(result["domain"])
+                    domain_results.append(result)
+        
+        # SSL certificates for each domain
+        ssl_results = []
+        for ssl_certificates in await asyncio.gather(*(ssl_checks[domain] for domain in domains)):
+            ssl_results.extend(ssl_certificates)
+        
+        # Mark domains and SSL certificates that are expiring soon; marked entries
+        # are copies, since the check results are shared with other subscriptions
+        domain_results = [
+            dict(result, status="Expiring Soon") if 0 < result["days_left"] < days_threshold else result
+            for result in domain_results
+        ]
+        ssl_results = [
+            dict(result, status="Expiring Soon") if 0 < result.get("days_to_expire", 0) < days_threshold else result
+            for result in ssl_results
+        ]
+        
+        # Every result is reported, with the expiring ones marked
+        return await self._send_notification(
+            email=email,
+            expiring_domains=domain_results,
+            expiring_certs=ssl_results,
+            days_threshold=days_threshold,
+            smtp_pool=smtp_pool
+        )
+        
+    async def _send_notification(self, email: str, expiring_domains: List[Dict[str, Any]], 
+                          expiring_certs: List[Dict[str, Any]], days_threshold: int,
+                          smtp_pool: Optional[SMTPPool] = None) -> Dict[str, Any]:
         """
         Send email notification for expiring domains and SSL certificates.
         
@@ -126,118 +271,52 @@ class NotificationScheduler:
             expiring_domains: List of domains expiring soon
             expiring_certs: List of SSL certificates expiring soon
             days_threshold: Days threshold used for checking
+            smtp_pool: Pool of SMTP connections to send over; a one-off
+                connection is opened for this message if it is None
             
         Returns:
             Dict with notification status
         """
         try:
             # Create message
-            msg = MIMEMultipart()
+            msg = EmailMessage(policy=policy.SMTP)
             msg['From'] = self.from_email
+            msg['Subject'] = NOTIFICATION_SUBJECT
             msg['To'] = email
-            msg['Subject'] = f"ALERT: Domains and SSL Certificates Expiring Soon"
-            
-            # Create the email body
-            body = f"""
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; }}
-                    h1, h2 {{ color: #333; }}
-                    .expiry-alert {{ color: #cc0000; font-weight: bold; }}
-                    table {{ border-collapse: collapse; width: 100%; margin: 20px 0; }}
-                    th, td {{ border: 1px solid #ddd; padding: 8px; text-align: left; }}
-                    th {{ background-color: #f2f2f2; }}
-                    .alert {{ color: #cc0000; }}
-                </style>
-            </head>
-            <body>
-                <h1>Domain and SSL Certificate Expiry Alert</h1>
-                <p>This is an automated notification about your domains and SSL certificates that will expire within the next {days_threshold} days.</p>
-            """
-            
-            # Add domain expiry information
-            if expiring_domains:
-                body += """
-                <h2>Domains Expiring Soon</h2>
-                <table>
-                    <tr>
-                        <th>Domain</th>
-                        <th>Expiry Date</th>
-                        <th>Days Left</th>
-                        <th>Registrar</th>
-                    </tr>
-                """
-                
-                for domain in expiring_domains:
-                    body += f"""
-                    <tr>
-                        <td>{domain['domain']}</td>
-                        <td>{domain['expiry_date']}</td>
-                        <td class="alert">{domain['days_left']}</td>
-                        <td>{domain['registrar']}</td>
-                    </tr>
-                    """
-                
-                body += """
-                </table>
-                <p>Please renew these domains soon to avoid service interruptions.</p>
-                """
             
-            # Add SSL certificate expiry information
-            if expiring_certs:
-                body += """
-                <h2>SSL Certificates Expiring Soon</h2>
-                <table>
-                    <tr>
-                        <th>Hostname</th>
-                        <th>Issuer</th>
-                        <th>Expiry Date</th>
-                        <th>Days Left</th>
-                    </tr>
-                """
-                
-                for cert in expiring_certs:
-                    body += f"""
-                    <tr>
-                        <td>{cert['hostname']}</td>
-                        <td>{cert.get('cert_issuer',"")}</td>
-                        <td>{cert.get('not_after',"")}</td>
-                        <td class="alert">{cert.get('days_to_expire',-1)}</td>
-                    </tr>
-                    """
-                
-                body += """
-                </table>
-                <p>Please renew these SSL certificates soon to avoid security warnings and connection problems.</p>
-                """
+            # Render the email body
+            body = NOTIFICATION_TEMPLATE.render(
+                days_threshold=days_threshold,
+                expiring_domains=expiring_domains,
+                expiring_certs=expiring_certs
+            )
             
-            # Add footer
-            body += """
-                <p>To manage your notification settings, visit our Domain & SSL Expiry Checker tool.</p>
-                <p>If you no longer wish to receive these notifications, you can unregister your domains.</p>
-            </body>
-            </html>
-            """
+            msg.set_content(body, subtype='html')
             
-            msg.attach(MIMEText(body, 'html'))
+            # One timestamp for the analytics event and the returned result
+            timestamp = datetime.datetime.now().isoformat()
             
             # Send email if SMTP credentials are configured
             if self.smtp_username and self.smtp_password:
                 try:
-                    server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-                    server.starttls()
-                    server.login(self.smtp_username, self.smtp_password)
-                    text = msg.as_string()
-                    server.sendmail(self.from_email, email, text)
-                    server.quit()
+                    if smtp_pool is not None:
+                        await smtp_pool.send(msg)
+                    else:
+                        # No pool (e.g. immediate notifications), send over a one-off connection
+                        await aiosmtplib.send(
+                            msg,
+                            hostname=self.smtp_server,
+                            port=self.smtp_port,
+                            username=self.smtp_username,
+                            password=self.smtp_password,
+                            start_tls=True
+                        )
                     
                     logging.info(f"Notification email sent to {email}")
                     sent = True
                     
                     # Track successful notification in PostHog
                     try:
-                        from .analytics import track_event
                         track_event(
                             distinct_id=email,
                             event_name='notification_sent',
@@ -246,7 +325,7 @@ class NotificationScheduler:
                                 'expiring_domains_count': len(expiring_domains),
                                 'expiring_certs_count': len(expiring_certs),
                                 'threshold_days': days_threshold,
-                                'timestamp': datetime.datetime.now().isoformat()
+                                'timestamp': timestamp
                             }
                         )
                     except Exception as analytics_error:
@@ -258,7 +337,6 @@ class NotificationScheduler:
                     
                     # Track failed notification in PostHog
                     try:
-                        from .analytics import track_event
                         track_event(
                             distinct_id=email,
                             event_name='notification_failed',
@@ -268,7 +346,7 @@ class NotificationScheduler:
                                 'expiring_domains_count': len(expiring_domains),
                                 'expiring_certs_count': len(expiring_certs),
                                 'threshold_days': days_threshold,
-                                'timestamp': datetime.datetime.now().isoformat()
+                                'timestamp': timestamp
                             }
                         )
                     except Exception as analytics_error:
@@ -280,7 +358,6 @@ class NotificationScheduler:
                 
                 # Track skipped notification in PostHog (SMTP not configured)
                 try:
-                    from .analytics import track_event
                     track_event(
                         distinct_id=email,
                         event_name='notification_skipped',
@@ -289,7 +366,7 @@ class NotificationScheduler:
                             'expiring_domains_count': len(expiring_domains),
                             'expiring_certs_count': len(expiring_certs),
                             'threshold_days': days_threshold,
-                            'timestamp': datetime.datetime.now().isoformat()
+                            'timestamp': timestamp
                         }
                     )
                 except Exception as analytics_error:
@@ -301,7 +378,7 @@ class NotificationScheduler:
                 "sent": sent,
                 "expiring_domains_count": len(expiring_domains),
                 "expiring_certs_count": len(expiring_certs),
-                "timestamp": datetime.datetime.now().isoformat()
+                "timestamp": timestamp
             }
             
         except Exception as e:
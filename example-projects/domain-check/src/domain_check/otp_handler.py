@@ -1,6 +1,8 @@
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+import functools
 import hashlib
+import hmac
 import os
 import smtplib
 import redis
@@ -8,6 +10,7 @@ import logging
 import secrets
 import string
 import datetime
+import threading
 from typing import Dict, Any, Optional, Tuple
 
 from .init_application import initialization_result
@@ -23,6 +26,36 @@ logger = logging.getLogger(__name__)
 if initialization_result["debug_mode"]:
     logger.setLevel(logging.DEBUG)
 
+# Fetch the stored OTP fields and mark the code as verified in a single round trip.
+# ARGV[2] is the current time in the same ISO format as the stored expiry, so the
+# two compare as strings; an expired code is returned without being marked.
+# The final comparison is still done in Python in constant time.
+VERIFY_OTP_SCRIPT = """
+local data = redis.call('HMGET', KEYS[1], 'otp', 'expiry', 'verified')
+if data[2] and data[2] < ARGV[2] then
+    return data
+end
+if data[1] and data[1] == ARGV[1] and data[3] ~= 'true' then
+    redis.call('HSET', KEYS[1], 'verified', 'true')
+end
+return data
+"""
+
+def format_created_time(created_time: str) -> str:
+    """
+    Format an ISO creation timestamp as "YYYY-MM-DD HH:MM:SS" for display.
+    
+    datetime.isoformat() output has fixed-width date and time fields, so
+    slicing avoids parsing the string back into a datetime.
+    
+    Args:
+        created_time: ISO formatted timestamp
+        
+    Returns:
+        str: Timestamp formatted for display
+    """
+    return f"{created_time[:10]} {created_time[11:19]}"
+
 class OTPHandler:
     """
     Handler for generating, storing, and verifying one-time passwords (OTPs)
@@ -52,6 +85,7 @@ class OTPHandler:
             # Test the connection
             self.redis_client.ping()
             logger.info("Redis connection successful")
+            self.verify_otp_script = self.redis_client.register_script(VERIFY_OTP_SCRIPT)
             
         except redis.RedisError as e:
             logger.error(f"Failed to connect to Redis: {e}")
@@ -60,10 +94,18 @@ class OTPHandler:
             
         # In-memory storage as fallback
         self.otp_store = {}
+        
+        # SMTP connection reused across OTP emails; emails are sent from worker
+        # threads, so access is serialized with a lock
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
     
-    def _hash_email(self, email: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=4096)
+    def _hash_email(email: str) -> str:
         """
         Create a hash of the email address to use as the Redis key.
+        Results are memoized since the same addresses are hashed on every request.
         
         Args:
             email: The email address to hash
@@ -205,12 +247,13 @@ class OTPHandler:
             otp_data = None
             
             if self.redis_client:
-                # Get from Redis
-                redis_data = self.redis_client.hgetall(otp_key)
+                # Get from Redis, marking the OTP as verified if it matches
+                stored_otp, expiry, verified = self.verify_otp_script(
+                    keys=[otp_key], args=[otp, datetime.datetime.now().isoformat()]
+                )
                 
-                if redis_data:
-                    # Convert bytes to string
-                    otp_data = {k: v for k, v in redis_data.items()}
+                if stored_otp is not None:
+                    otp_data = {"otp": stored_otp, "expiry": expiry, "verified": verified}
             else:
                 # Get from in-memory storage
                 otp_data = self.otp_store.get(email_hash)
@@ -219,7 +262,7 @@ class OTPHandler:
                 return False, "No OTP found for this email address"
             
             # Check if OTP matches
-            if otp_data.get("otp") != otp:
+            if not hmac.compare_digest(otp_data.get("otp", "").encode(), otp.encode()):
                 return False, "Invalid OTP"
             
             # Check if OTP is expired
@@ -231,10 +274,8 @@ class OTPHandler:
             if otp_data.get("verified") == "true":
                 #return False, "OTP has already been used", None
                 return True, "OTP reverified successfully"
-            # Mark as verified
-            if self.redis_client:
-                self.redis_client.hset(otp_key, "verified", "true")
-            else:
+            # Mark as verified (the Redis script has already done this)
+            if not self.redis_client:
                 self.otp_store[email_hash]["verified"] = "true"
             
             # Return success with operation
@@ -242,9 +283,7 @@ class OTPHandler:
             return True, "OTP verified successfully"
             
         except Exception as e:
-            import traceback
-            logger.error(traceback.format_exc())
-            logger.error(f"Error verifying OTP: {e}")
+            logger.exception("Error verifying OTP: %s", e)
             return False, f"Error verifying OTP: {str(e)}"
     
     def send_otp_email(self, email: str, otp: str, operation: str, created_time: str) -> bool:
@@ -277,7 +316,7 @@ class OTPHandler:
             # Create email body with OTP
             operation_text = "registration" if operation == "register" else "viewing domain information"
             expiry_days = int(initialization_result["env_vars"].get("OTP_EXPIRY_DAYS", 30))
-            created_date = datetime.datetime.fromisoformat(created_time).strftime("%Y-%m-%d %H:%M:%S")
+            created_date = format_created_time(created_time)
             
             body = f"""
             <html>
@@ -317,12 +356,16 @@ class OTPHandler:
             
             # Send email if SMTP credentials are configured
             if smtp_username and smtp_password:
-                server = smtplib.SMTP(smtp_server, smtp_port)
-                server.starttls()
-                server.login(smtp_username, smtp_password)
                 text = msg.as_string()
-                server.sendmail(from_email, email, text)
-                server.quit()
+                with self._smtp_lock:
+                    try:
+                        server = self._get_smtp_connection(smtp_server, smtp_port, smtp_username, smtp_password)
+                        server.sendmail(from_email, email, text)
+                    except smtplib.SMTPServerDisconnected:
+                        # The server closed the connection after the NOOP; retry once on a fresh one
+                        self._close_smtp()
+                        server = self._get_smtp_connection(smtp_server, smtp_port, smtp_username, smtp_password)
+                        server.sendmail(from_email, email, text)
                 
                 logger.info(f"OTP email sent to {email}")
                 return True
@@ -335,6 +378,53 @@ class OTPHandler:
             logger.error(f"Failed to send OTP email to {email}: {e}")
             return False
     
+    def _get_smtp_connection(self, smtp_server: str, smtp_port: int,
+                             smtp_username: str, smtp_password: str) -> smtplib.SMTP:
+        """
+        Get the shared SMTP connection, opening and logging in if there isn't one yet.
+        Must be called with the SMTP lock held.
+        
+        Servers drop idle connections, so a kept connection is checked with NOOP
+        first and replaced if it no longer answers.
+        
+        Returns:
+            smtplib.SMTP: An authenticated SMTP connection
+        """
+        if self._smtp is not None:
+            try:
+                alive = self._smtp.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                alive = False
+            if not alive:
+                logger.info("SMTP connection is no longer open, reconnecting")
+                self._close_smtp()
+        if self._smtp is None:
+            server = smtplib.SMTP(smtp_server, smtp_port)
+            server.starttls()
+            server.login(smtp_username, smtp_password)
+            self._smtp = server
+        return self._smtp
+    
+    def _close_smtp(self) -> None:
+        """
+        Close the shared SMTP connection, if any. Must be called with the SMTP lock held.
+        """
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            # Already disconnected; just release the socket
+            self._smtp.close()
+        self._smtp = None
+    
+    def close(self) -> None:
+        """
+        Close the SMTP connection kept open for OTP emails. Call on shutdown.
+        """
+        with self._smtp_lock:
+            self._close_smtp()
+    
     def reset_otp(self, email: str) -> bool:
         """
         Reset (delete) the OTP for the given email after operation is complete.
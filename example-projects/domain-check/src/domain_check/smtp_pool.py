@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PooledConnection:
+    """An authenticated SMTP connection and the number of messages sent over it."""
+    server: aiosmtplib.SMTP
+    sent_count: int = 0
+
+    async def alive(self) -> bool:
+        """Check with NOOP that the connection can still be used."""
+        try:
+            return (await self.server.noop()).code == 250
+        except (aiosmtplib.SMTPException, OSError):
+            return False
+
+    async def close(self) -> None:
+        """Quit the connection, dropping it if the server doesn't answer."""
+        try:
+            await self.server.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            self.server.close()
+
+class SMTPPool:
+    """
+    A fixed-size pool of authenticated SMTP connections shared by concurrent
+    notification tasks.
+
+    Connections are opened lazily, checked with NOOP before reuse and replaced
+    after max_messages_per_connection sends to stay under provider limits on
+    messages per connection. At most pool_size messages are sent at once.
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 pool_size: int = 5, max_messages_per_connection: int = 100):
+        """
+        Initialize the pool.
+
+        Args:
+            host: SMTP server hostname
+            port: SMTP server port
+            username: SMTP login username
+            password: SMTP login password
+            pool_size: Maximum number of open connections
+            max_messages_per_connection: Messages sent before a connection is recycled
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_messages_per_connection = max_messages_per_connection
+
+        # Each slot holds a PooledConnection, or None until it is first used
+        self._connections: "asyncio.Queue[Optional[PooledConnection]]" = asyncio.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._connections.put_nowait(None)
+
+    async def _connect(self) -> PooledConnection:
+        """Open an SMTP connection, upgrade it to TLS and log in."""
+        server = aiosmtplib.SMTP(hostname=self.host, port=self.port, start_tls=True)
+        await server.connect()
+        await server.login(self.username, self.password)
+        return PooledConnection(server)
+
+    async def send(self, message: EmailMessage) -> None:
+        """
+        Send a message over a pooled connection, waiting until one is free.
+
+        Args:
+            message: Message to send; sender and recipients are taken from its headers
+
+        Raises:
+            aiosmtplib.SMTPException, OSError: If the message could not be sent
+        """
+        conn = await self._connections.get()
+        try:
+            if conn is not None and (conn.sent_count >= self.max_messages_per_connection or not await conn.alive()):
+                await conn.close()
+                conn = None
+            if conn is None:
+                conn = await self._connect()
+
+            await conn.server.send_message(message)
+            conn.sent_count += 1
+        except BaseException:
+            # Don't hand a connection in an unknown state to the next sender;
+            # this includes a send cut short by cancellation
+            if conn is not None:
+                conn.server.close()
+                conn = None
+            raise
+        finally:
+            self._connections.put_nowait(conn)
+
+    async def close(self) -> None:
+        """Quit every idle connection in the pool; slots reconnect on next use."""
+        slots = 0
+        while True:
+            try:
+                conn = self._connections.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            slots += 1
+            if conn is not None:
+                await conn.close()
+        for _ in range(slots):
+            self._connections.put_nowait(None)
+        logger.debug("SMTP pool closed")
@@ -1,117 +1,242 @@
 """SSL Certificate checker module to validate SSL certificates for domains and subdomains."""
 
+import asyncio
+import functools
+import os
 import socket
 import ssl
+import dns.asyncresolver
+import dns.name
+import dns.rdatatype
 import dns.resolver
-import OpenSSL
-import datetime
-from typing import List, Dict, Optional
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Dict, Optional, Tuple
 import logging
-import requests
 from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 import idna
-from .enhanced_cached import enhanced_cached,custom_key_builder
-from .enhanced_cached import Cache,RedisCache
-from .enhanced_cached import JsonSerializer
-from .init_application import initialization_result
+import orjson
+import redis.asyncio as redis_async
+from cryptography import x509
 # Configure logging for the module
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Certificate checks are blocking socket/DNS I/O; run up to this many at once in
+# threads shared by every SSLChecker, so checks for different hosts overlap
+# instead of stalling the event loop one by one
+SSL_CHECK_MAX_WORKERS = 32
+_executor = ThreadPoolExecutor(max_workers=SSL_CHECK_MAX_WORKERS, thread_name_prefix="ssl-check")
+
+class _TTLCache:
+    """
+    In-process cache holding at most maxsize entries, each for ttl seconds.
+    
+    When full, the least recently used entry is evicted, so the cache stays
+    bounded however many distinct keys it sees.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Cached value for key, or None if it is missing or has expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache value for key, evicting the least recently used entries if full."""
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+# Each datum has one cache, so results are at most this old:
+#   - DNS answers: their record TTL (the resolver's LRUCache)
+#   - discovered subdomains: SUBDOMAIN_CACHE_TTL (_subdomain_cache)
+#   - certificates: SSL_CACHE_TTL when fetched by this process, or
+#     SSL_RECHECK_INTERVAL when read back from the Redis store
+# days_to_expire is always recomputed from not_after, never cached.
+
+# Certificates fetched in this process, keyed by (hostname, port) and kept for
+# SSL_CACHE_TTL seconds so hosts shared by many subscribers are handshaked once
+SSL_CACHE_TTL = int(os.environ.get("SSL_CACHE_TTL", 3600))
+SSL_CACHE_MAX_SIZE = 10000
+_certificate_cache = _TTLCache(maxsize=SSL_CACHE_MAX_SIZE, ttl=SSL_CACHE_TTL)
+
+# Unreachable hosts should fail fast; the full timeout only applies once connected
+SSL_CONNECT_TIMEOUT = 2.0  # seconds
+
+# Subdomains discovered per domain, reused for SUBDOMAIN_CACHE_TTL seconds; most
+# A/AAAA records have TTLs of around five minutes
+SUBDOMAIN_CACHE_TTL = 300
+SUBDOMAIN_CACHE_MAX_SIZE = 10000
+_subdomain_cache = _TTLCache(maxsize=SUBDOMAIN_CACHE_MAX_SIZE, ttl=SUBDOMAIN_CACHE_TTL)
+
+# Certificates persisted in Redis and shared by every process. A stored
+# certificate is trusted without a new handshake for SSL_RECHECK_INTERVAL seconds
+# while it has more than SSL_RECHECK_MIN_DAYS left. A replaced certificate can
+# expire earlier than the stored one (a reissue, a CA with shorter lifetimes, a
+# misdeployed or expired one), so the interval stays well under the daily
+# schedule: no scheduled run sees a certificate checked more than half a day ago
+SSL_EXPIRY_KEY_PREFIX = "ssl_expiry:"
+SSL_RECHECK_INTERVAL = int(os.environ.get("SSL_RECHECK_INTERVAL", 12 * 3600))
+SSL_RECHECK_MIN_DAYS = int(os.environ.get("SSL_RECHECK_MIN_DAYS", 45))
+
+@functools.lru_cache(maxsize=65536)
+def _idna_encode(host: str) -> str:
+    """ASCII form of a hostname to connect to, with IDN labels punycode-encoded."""
+    # Most hostnames are plain ASCII and need none of idna's costly validation
+    if host.isascii():
+        return host
+    return idna.encode(host).decode('ascii')
+
+def _san_covers(hostname: str, subject_alt_names: List[str]) -> bool:
+    """Whether a certificate's DNS names, wildcards included, cover a hostname."""
+    hostname = hostname.lower()
+    parent = hostname.partition('.')[2]
+    for name in subject_alt_names:
+        name = name.lower()
+        if name == hostname or (name.startswith('*.') and name[2:] == parent):
+            return True
+    return False
+
+def _days_to_expire(not_after: str) -> int:
+    """Days left until a certificate notAfter timestamp."""
+    # cert_time_to_seconds parses the fixed notAfter format straight to an epoch,
+    # avoiding strptime's slow locale-aware path
+    return int((ssl.cert_time_to_seconds(not_after) - time.time()) // 86400)
+
 class SSLChecker:
     """
     A class to check SSL certificates for a domain and its subdomains.
     Provides methods to discover subdomains, retrieve SSL certificate details,
     and check certificate validity/expiration.
     """
-    def __init__(self, verify_ssl: bool = True, timeout: int = 10):
+    # Prefixes probed during subdomain discovery, parsed into relative DNS names
+    # once so each lookup only joins them to the domain
+    COMMON_SUBDOMAINS = (
+        'www', 'mail', 'webmail', 'blog', 'shop',
+        'dev', 'api', 'admin', 'portal', 'staging'
+    )
+    _SUBDOMAIN_PREFIXES = tuple(dns.name.from_text(prefix, origin=None) for prefix in COMMON_SUBDOMAINS)
+    _RECORD_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA, dns.rdatatype.CNAME)
+    # Upper bound on each discovery query, including retries
+    SUBDOMAIN_QUERY_LIFETIME = 2.0  # seconds
+
+    def __init__(self, verify_ssl: bool = True, timeout: int = 10,
+                 resolver: Optional[dns.resolver.Resolver] = None,
+                 redis_client: Optional[redis_async.Redis] = None):
         """
         Initialize SSL Checker with configuration options.
 
         Args:
             verify_ssl (bool): Whether to verify SSL certificates.
             timeout (int): Connection timeout in seconds.
+            resolver (Optional[dns.resolver.Resolver]): DNS resolver to reuse for
+                subdomain discovery. A new one is created if not provided.
+            redis_client (Optional[redis_async.Redis]): Redis client used to persist
+                certificate expiry between runs. Every check goes to the network
+                if not provided.
         """
         self.verify_ssl = verify_ssl
         self.timeout = timeout
+        # Build the resolver once; constructing one re-reads the system resolver config
+        self.resolver = resolver or dns.resolver.Resolver()
+        if self.resolver.cache is None:
+            # Answer positive lookups from memory for the lifetime of their records
+            self.resolver.cache = dns.resolver.LRUCache(max_size=10000)
+        # Async twin of the resolver for concurrent subdomain discovery, sharing its
+        # nameservers and answer cache
+        self.async_resolver = dns.asyncresolver.Resolver(configure=False)
+        self.async_resolver.nameservers = self.resolver.nameservers
+        self.async_resolver.timeout = self.resolver.timeout
+        self.async_resolver.lifetime = min(self.resolver.lifetime, self.SUBDOMAIN_QUERY_LIFETIME)
+        self.async_resolver.cache = self.resolver.cache
         self.context = ssl.create_default_context()
+        self.context.minimum_version = ssl.TLSVersion.TLSv1_2
         if not verify_ssl:
             self.context.check_hostname = False
             self.context.verify_mode = ssl.CERT_NONE
+        self.executor = _executor
+        self.redis_client = redis_client
 
-    def get_subdomains(self, domain: str) -> List[str]:
+    async def get_subdomains(self, domain: str) -> Dict[str, Optional[str]]:
         """
         Find subdomains using DNS records and common subdomain prefixes.
 
+        All lookups are sent concurrently, so discovery takes about one DNS
+        round trip instead of one per query.
+
         Args:
             domain (str): Root domain to check.
 
         Returns:
-            List[str]: List of discovered subdomains.
+            Dict[str, Optional[str]]: Discovered subdomains, each mapped to the
+            target of its CNAME record or None if it has none.
         """
-        subdomains = set()
+        cached = _subdomain_cache.get(domain)
+        if cached is not None:
+            return dict(cached)
+        
+        subdomains: Dict[str, Optional[str]] = {}
         try:
-            # Create a DNS resolver instance
-            resolver = dns.resolver.Resolver()
+            # Try to find subdomains by brute-forcing common prefixes; names are
+            # absolute, so no search domains are tried
+            domain_name = dns.name.from_text(domain)
+            names = [(domain, domain_name)] + [
+                (f"{subdomain}.{domain}", prefix.concatenate(domain_name))
+                for subdomain, prefix in zip(self.COMMON_SUBDOMAINS, self._SUBDOMAIN_PREFIXES)
+            ]
             
-            # Fetch all DNS records for the domain
-            record_types = ['A', 'AAAA', 'CNAME']
-            for record_type in record_types:
-                try:
-                    # Fetch A records for the domain itself
-                    answers = resolver.resolve(domain, record_type)
-                    print("AAA",len(answers))
-                    for rdata in answers:
-                        if record_type in ['A', 'AAAA']:
-                            # Add the domain itself (if it resolves)
-                            subdomains.add(domain)
-                        elif record_type == 'CNAME':
-                            cname_target = str(rdata.target).rstrip('.')
-                            subdomains.add(cname_target)
-                except Exception as e:
-                    logging.debug(f"Error checking {record_type} records for {domain}: {e}")
-                    continue
-
-            # Try to find subdomains by brute-forcing common prefixes
-            common_subdomains = [
-                'www', 'mail', 'webmail', 'blog', 'shop', 
-                'dev', 'api', 'admin', 'portal', 'staging'
+            # Query every record type for the domain itself and each prefix at once
+            queries = [
+                (full_domain, name, record_type)
+                for full_domain, name in names
+                for record_type in self._RECORD_TYPES
             ]
-            for subdomain in common_subdomains:
-                try:
-                    full_domain = f"{subdomain}.{domain}"
-                    for record_type in record_types:
-                        try:
-                            answers = resolver.resolve(full_domain, record_type)
-                            subdomains.add(full_domain)
-                        except Exception:
-                            continue
-                except Exception:
+            answers = await asyncio.gather(
+                *(self.async_resolver.resolve(name, record_type, search=False) for _, name, record_type in queries),
+                return_exceptions=True
+            )
+            
+            for (full_domain, _, record_type), answer in zip(queries, answers):
+                if isinstance(answer, Exception):
+                    # NXDOMAIN, no answer or timeout
+                    if full_domain == domain:
+                        logging.debug(f"Error checking {dns.rdatatype.to_text(record_type)} records for {domain}: {answer}")
                     continue
-
-
+                
+                if full_domain != domain:
+                    subdomains.setdefault(full_domain, None)
+                    if record_type == dns.rdatatype.CNAME:
+                        subdomains[full_domain] = str(answer[0].target).rstrip('.').lower()
+                elif record_type in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                    # Add the domain itself (if it resolves)
+                    subdomains.setdefault(domain, None)
+                elif record_type == dns.rdatatype.CNAME:
+                    for rdata in answer:
+                        cname_target = str(rdata.target).rstrip('.')
+                        subdomains.setdefault(cname_target, None)
                     
         except Exception as e:
             logging.error(f"Error finding subdomains for {domain}: {e}")
-            
-        return list(subdomains)
-
-    @enhanced_cached(    
-    ttl=86400,  # 24 hours (60*60*24)
-    cache=Cache.REDIS,
-    track_stats=True,
-    key_builder=custom_key_builder,
-    serializer=JsonSerializer(),
-    namespace=initialization_result["env_vars"]["REDIS_NAMESPACE"],
-    endpoint=initialization_result["env_vars"]["REDIS_HOST"],
-    port=initialization_result["env_vars"]["REDIS_PORT"],
-    password=initialization_result["env_vars"]["REDIS_PASSWORD"],
-    db=initialization_result["env_vars"]["REDIS_DB"],
-    pool_max_size=2                 
-    )
+        
+        # Also remembers prefixes that didn't resolve, which the resolver cache doesn't
+        _subdomain_cache.set(domain, dict(subdomains))
+        return subdomains
+
     async def get_certificate_info(self, hostname: str, port: int = 443) -> Optional[Dict]:
         """
         Get SSL certificate information for a given hostname.
@@ -132,47 +257,33 @@ class SSLChecker:
             # Only apply IDN encoding for valid hostnames without underscores
             if '_' not in parsed_url.netloc:
                 try:
-                    host_for_connection = idna.encode(parsed_url.netloc).decode('ascii')
+                    host_for_connection = _idna_encode(parsed_url.netloc)
                 except Exception as e:
                     logging.warning(f"IDN encoding failed for {hostname}: {e}, using original hostname")
             
-            # Create a socket connection and wrap it with SSL
-            with socket.create_connection((host_for_connection, port), timeout=self.timeout) as sock:
-                with self.context.wrap_socket(sock, server_hostname=host_for_connection) as ssock:
-                    cert = ssock.getpeercert()
-                    
-                    # Get certificate in binary form for additional details
-                    cert_binary = ssock.getpeercert(binary_form=True)
-                    x509 = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_ASN1, cert_binary)
-                    
-                    # Parse certificate expiration date
-                    not_after = datetime.datetime.strptime(cert['notAfter'], '%b %d %H:%M:%S %Y GMT')
-                    days_to_expire = (not_after - datetime.datetime.utcnow()).days
-                    
-                    # Extract issuer and subject as dictionaries
-                    issuer_dict = {}
-                    for issuer_part in cert['issuer']:
-                        for key, value in issuer_part:
-                            issuer_dict[key] = value
-                    
-                    subject_dict = {}
-                    for subject_part in cert['subject']:
-                        for key, value in subject_part:
-                            subject_dict[key] = value
-                            
-                    return {
-                        'hostname': hostname,
-                        'issuer': issuer_dict,
-                        'subject': subject_dict,
-                        'version': x509.get_version(),
-                        'serial_number': format(x509.get_serial_number(), 'x'),
-                        'not_before': cert['notBefore'],
-                        'not_after': cert['notAfter'],
-                        'days_to_expire': days_to_expire,
-                        'expired': days_to_expire < 0,
-                        'cert_issuer': issuer_dict.get('organizationName', 'Unknown'),
-                        'cert_organization': subject_dict.get('commonName', 'Unknown'),
-                    }
+            # Serve recently fetched certificates from the process cache; only the
+            # days left are recomputed since the expiry date itself doesn't change
+            cache_key = (hostname, port)
+            cached = _certificate_cache.get(cache_key)
+            if cached is not None:
+                days_to_expire = _days_to_expire(cached['not_after'])
+                return dict(cached, days_to_expire=days_to_expire, expired=days_to_expire < 0)
+            
+            # Certificates checked recently in an earlier run and far from expiry
+            # don't need a new handshake
+            info = await self._load_stored_certificate(hostname, port)
+            if info is not None:
+                # Already cached in Redis; keeping it here too would stretch its age
+                return info
+            
+            # Do the blocking connect and handshake on a worker thread
+            loop = asyncio.get_running_loop()
+            info = await loop.run_in_executor(
+                self.executor, self._fetch_certificate_info, hostname, host_for_connection, port
+            )
+            await self._store_certificate(hostname, port, info)
+            _certificate_cache.set(cache_key, info)
+            return dict(info)
                     
         except (socket.gaierror, socket.timeout) as e:
             logging.error(f"Network error checking {hostname}: {e}")
@@ -195,9 +306,7 @@ class SSLChecker:
             'expired': True
             }
         except Exception as e:
-            logging.error(f"Error checking certificate for {hostname}: {e}")
-            import traceback
-            traceback.print_exc()
+            logging.exception("Error checking certificate for %s: %s", hostname, e)
             return {
             'hostname': hostname,
             'status': f"Certificate check failed: {str(e)}",
@@ -207,6 +316,134 @@ class SSLChecker:
             'expired': True
             }
 
+    async def _load_stored_certificate(self, hostname: str, port: int) -> Optional[Dict]:
+        """
+        Get a certificate persisted by an earlier check, if it can still be trusted.
+
+        Args:
+            hostname (str): Domain the certificate was fetched for.
+            port (int): SSL port.
+
+        Returns:
+            Optional[Dict]: Certificate information with days_to_expire recomputed,
+            or None if the certificate has to be fetched again.
+        """
+        if self.redis_client is None:
+            return None
+        try:
+            stored = await self.redis_client.get(f"{SSL_EXPIRY_KEY_PREFIX}{hostname}:{port}")
+        except Exception as e:
+            logging.warning(f"Failed to read stored certificate for {hostname}: {e}")
+            return None
+        if stored is None:
+            return None
+        
+        info = orjson.loads(stored)
+        days_to_expire = _days_to_expire(info['not_after'])
+        if days_to_expire <= SSL_RECHECK_MIN_DAYS:
+            return None
+        logging.debug("Using stored certificate for %s, %d days left", hostname, days_to_expire)
+        return dict(info, days_to_expire=days_to_expire, expired=False)
+
+    async def _store_certificate(self, hostname: str, port: int, info: Dict) -> None:
+        """
+        Persist a fetched certificate for SSL_RECHECK_INTERVAL seconds.
+
+        Args:
+            hostname (str): Domain the certificate was fetched for.
+            port (int): SSL port.
+            info (Dict): Certificate information.
+        """
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.set(
+                f"{SSL_EXPIRY_KEY_PREFIX}{hostname}:{port}", orjson.dumps(info), ex=SSL_RECHECK_INTERVAL
+            )
+        except Exception as e:
+            logging.warning(f"Failed to store certificate for {hostname}: {e}")
+
+    def _fetch_certificate_info(self, hostname: str, host_for_connection: str, port: int) -> Dict:
+        """
+        Connect to a host, complete the TLS handshake and parse its certificate.
+
+        Args:
+            hostname (str): Domain reported in the result.
+            host_for_connection (str): IDN-encoded host to connect to.
+            port (int): SSL port.
+
+        Returns:
+            Dict: Certificate information.
+        """
+        # Create a socket connection with a short connect timeout, then allow the
+        # full timeout for the handshake, and wrap it with SSL
+        with socket.create_connection((host_for_connection, port), timeout=min(SSL_CONNECT_TIMEOUT, self.timeout)) as sock:
+            sock.settimeout(self.timeout)
+            # Always a full handshake: a resumed session skips chain verification
+            # and reports the certificate stored with the session, not the one
+            # the server serves now
+            with self.context.wrap_socket(sock, server_hostname=host_for_connection) as ssock:
+                cert = ssock.getpeercert()
+                
+                # Get certificate in binary form for additional details
+                cert_binary = ssock.getpeercert(binary_form=True)
+                cert_obj = x509.load_der_x509_certificate(cert_binary)
+                
+                # Parse certificate expiration date
+                days_to_expire = _days_to_expire(cert['notAfter'])
+                
+                # Extract issuer and subject as dictionaries
+                issuer_dict = {}
+                for issuer_part in cert['issuer']:
+                    for key, value in issuer_part:
+                        issuer_dict[key] = value
+                
+                subject_dict = {}
+                for subject_part in cert['subject']:
+                    for key, value in subject_part:
+                        subject_dict[key] = value
+                        
+                return {
+                    'hostname': hostname,
+                    'issuer': issuer_dict,
+                    'subject': subject_dict,
+                    'version': cert_obj.version.value,
+                    'serial_number': format(cert_obj.serial_number, 'x'),
+                    'not_before': cert['notBefore'],
+                    'not_after': cert['notAfter'],
+                    'subject_alt_names': [value for kind, value in cert.get('subjectAltName', ()) if kind == 'DNS'],
+                    'days_to_expire': days_to_expire,
+                    'expired': days_to_expire < 0,
+                    'cert_issuer': issuer_dict.get('organizationName', 'Unknown'),
+                    'cert_organization': subject_dict.get('commonName', 'Unknown'),
+                }
+
+    async def _check_host_group(self, hosts: List[str]) -> List[Optional[Dict]]:
+        """
+        Check the certificates of hosts that share a CNAME target.
+
+        The first host is checked, and its certificate is reused for every other
+        host its subject alternative names cover. The rest are checked separately.
+
+        Args:
+            hosts (List[str]): Hostnames behind the same CNAME target.
+
+        Returns:
+            List[Optional[Dict]]: Certificate information for each host.
+        """
+        first = await self.get_certificate_info(hosts[0])
+        results = [first]
+        subject_alt_names = first.get('subject_alt_names') if first and not first.get('error_type') else None
+        
+        uncovered = []
+        for hostname in hosts[1:]:
+            if subject_alt_names and _san_covers(hostname, subject_alt_names):
+                results.append(dict(first, hostname=hostname))
+            else:
+                uncovered.append(hostname)
+        results.extend(await asyncio.gather(*(self.get_certificate_info(hostname) for hostname in uncovered)))
+        return results
+
     async def check_domain_certificates(self, domain: str, notification_threshold_days=30) -> List[Dict]:
         """
         Check SSL certificates for a domain and all its discovered subdomains.
@@ -221,15 +458,21 @@ class SSLChecker:
         results = []
         try:
             # Get list of subdomains to check
-            domains_to_check = set(self.get_subdomains(domain))
-            print(f"Domains to check: {domains_to_check}")
-            domains_to_check.add(domain)  # Add root domain
+            domains_to_check = await self.get_subdomains(domain)
+            logging.debug("Domains to check: %s", domains_to_check)
+            domains_to_check.setdefault(domain, None)  # Add root domain
+            
+            # Hosts that CNAME to the same target are usually served the same
+            # certificate, so each group starts with a single handshake
+            host_groups: Dict[str, List[str]] = {}
+            for hostname, cname_target in domains_to_check.items():
+                host_groups.setdefault(cname_target or hostname, []).append(hostname)
             
-            # Check certificates for each domain/subdomain
-            for d in domains_to_check:
-                print("getting the certificate info for ", d)
-                r1 = await self.get_certificate_info(d)
-                print(r1)
+            # Check certificates for all groups concurrently
+            group_infos = await asyncio.gather(*(self._check_host_group(hosts) for hosts in host_groups.values()))
+            cert_infos = [info for infos in group_infos for info in infos]
+            for r1 in cert_infos:
+                logging.debug("Certificate info: %s", r1)
                 if r1:
                     days_left = r1["days_to_expire"]
                     r1["domain"] = domain
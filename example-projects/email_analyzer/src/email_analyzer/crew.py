@@ -2,6 +2,7 @@ from crewai import Agent, Crew, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 
 from langchain_community.chat_models import ChatOpenAI
+import functools
 import os 
 from email_analyzer.tools.email_tools import EmailTools, TOutput
 
@@ -17,9 +18,11 @@ load_dotenv()
 # you can use the @before_kickoff and @after_kickoff decorators
 # https://docs.crewai.com/concepts/crews#example-crew-class-with-decorators
 
-llm = ChatOpenAI(api_key=os.getenv("OPENAI_API_KEY"),
-					model_name="gpt-4o-mini"
-		)
+# Built on first use and shared by every crew, including ones run concurrently
+@functools.lru_cache(maxsize=None)
+def get_llm():
+    return ChatOpenAI(api_key=os.getenv("OPENAI_API_KEY"),
+                      model_name="gpt-4o-mini")
 
 
 
@@ -43,7 +46,7 @@ class EmailAnalyzer():
             tools=[EmailTools.fetch_and_queue_emails,
                    EmailTools.fetch_and_process_email,
                    ],
-			llm=llm,
+			llm=get_llm(),
 			allow_delegation=False,
 			verbose=True,
 			return_direct=False
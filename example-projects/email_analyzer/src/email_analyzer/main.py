@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import asyncio
 import sys
 import warnings
 
@@ -14,7 +15,6 @@ warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 # interpolate any tasks and agents information
 
 from crewai.flow.flow import Flow, listen, start
-from langchain_community.chat_models import ChatOpenAI
 
 import os
 from dotenv import load_dotenv
@@ -24,16 +24,28 @@ load_dotenv()
 def run():
     """
     Run the crew.==
+
+    USER_EMAIL and FROM_EMAILS may each list several comma-separated addresses;
+    one crew runs for every user and sender pair, concurrently.
     """
-    email=os.getenv("USER_EMAIL")
-    fromemail="noreply@uber.com"
-    inputs={
-        'email': email,
-        'fromemail': fromemail
-    }
+    emails=[e.strip() for e in os.getenv("USER_EMAIL", "").split(",") if e.strip()]
+    if not emails:
+        raise ValueError("USER_EMAIL is not set; list at least one Gmail address to analyze")
+    fromemails=[e.strip() for e in os.getenv("FROM_EMAILS", "noreply@uber.com").split(",") if e.strip()]
+    inputs=[
+        {
+            'email': email,
+            'fromemail': fromemail
+        }
+        for email in emails
+        for fromemail in fromemails
+    ]
     print("email inputs are ",inputs)
     try:
-        EmailAnalyzer().crew().kickoff(inputs=inputs)
+        if len(inputs) == 1:
+            EmailAnalyzer().crew().kickoff(inputs=inputs[0])
+        else:
+            asyncio.run(EmailAnalyzer().crew().kickoff_for_each_async(inputs=inputs))
     except Exception as e:
         import traceback
         traceback.print_exc()
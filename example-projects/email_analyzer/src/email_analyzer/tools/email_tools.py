@@ -1,18 +1,23 @@
 # Define Tools for CrewAI
 
+import asyncio
+import functools
 import json
+import math
 import os
-from crewai import Agent, Task
+import time
 #from langchain.tools import tool
 from langchain_core.tools import BaseTool, StructuredTool, Tool
-from email_analyzer.tools.gmail_utils_supabase import get_cost_analytics,save_processed_email,fetch_emails,push_unique_emails_to_queues,fetch_and_process_email, remove_email_from_queue
+from email_analyzer.tools.gmail_utils_supabase import get_cost_analytics,save_processed_email,fetch_emails,push_unique_emails_to_queues,fetch_emails_from_queue, remove_emails_from_queue
 from textwrap import dedent
-from langchain_community.chat_models import ChatOpenAI
-from bs4 import BeautifulSoup
+from openai import APIConnectionError, APITimeoutError, DefaultHttpxClient, InternalServerError, OpenAI, RateLimitError
+import httpx
+import tenacity
 import re
 
 from crewai.tools import BaseTool
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional
 from crewai.tools import tool
 
 # class MyToolInput(BaseModel):
@@ -24,6 +29,330 @@ class TOutput(BaseModel):
     count: int
 
 
+# Expense details extracted from one receipt email; fields the email doesn't
+# mention are null
+class ExpenseSummary(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    email_id: Optional[str]
+    vendor: Optional[str]
+    subject: Optional[str]
+    date: Optional[str]
+    payment_mode: Optional[str]
+    expense_amount: Optional[str]
+    expense_details: Optional[str]
+    email_date: Optional[str]
+    email_recipient: Optional[str]
+    email_sender: Optional[str]
+
+
+# Structured outputs make the model reply with exactly this object, so replies
+# can be passed straight to json.loads
+EXPENSE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "expense_summary",
+        "strict": True,
+        "schema": ExpenseSummary.model_json_schema(),
+    },
+}
+
+
+# Number of emails taken from the queue per batch, and how many of them are
+# sent to the LLM at once; keep the latter under the OpenAI rate limits.
+EXPENSE_BATCH_SIZE = int(os.getenv("EXPENSE_BATCH_SIZE", 16))
+MAX_PARALLEL_AGENTS = int(os.getenv("MAX_PARALLEL_AGENTS", 8))
+
+# Each extraction request times out after OPENAI_TIMEOUT seconds and is tried
+# up to EXTRACT_ATTEMPTS times, waiting at most RETRY_MAX_WAIT seconds between tries
+OPENAI_TIMEOUT = 60.0
+EXTRACT_ATTEMPTS = 6
+RETRY_MAX_WAIT = 30
+
+# A batch stays hidden from other readers for as long as its slowest extraction
+# can take with every retry used, once per round of MAX_PARALLEL_AGENTS emails,
+# plus a minute to save the results; otherwise another crew could read and
+# process the same emails while this one is still retrying them.
+EXPENSE_VISIBILITY_TIMEOUT = math.ceil(EXPENSE_BATCH_SIZE / MAX_PARALLEL_AGENTS) * math.ceil(
+    EXTRACT_ATTEMPTS * OPENAI_TIMEOUT + (EXTRACT_ATTEMPTS - 1) * RETRY_MAX_WAIT
+) + 60
+
+
+# Set BATCH_MODE=1 to extract expenses through the OpenAI Batch API at half the
+# token cost; results arrive when the batch completes, within 24 hours
+BATCH_MODE = os.getenv("BATCH_MODE") == "1"
+BATCH_POLL_INTERVAL = int(os.getenv("BATCH_POLL_INTERVAL", 30))
+
+# Emails submitted to a batch job stay hidden from other readers this long:
+# the 24 hour completion window plus time to save the results. Emails whose
+# results aren't saved become visible again afterwards and are resubmitted.
+BATCH_VISIBILITY_TIMEOUT = 25 * 3600
+
+# Every saved summary is also appended to this file, one JSON object per line.
+# Batch API results are saved SAVE_BATCH_SIZE at a time as they are read.
+PROCESSED_EMAILS_FILE = "processed_emails.jsonl"
+SAVE_BATCH_SIZE = 50
+
+EXPENSE_BACKSTORY = dedent("""\
+    As an experienced expense management specialist, I have extensive expertise in 
+    analyzing ride-sharing receipts and travel expenses. I'm trained to quickly 
+    identify and extract key information from Uber and Ola emails, including trip 
+    dates, payment details, and expense amounts. My background includes years of 
+    working with corporate expense management systems and automated receipt 
+    processing, making me highly efficient at categorizing and organizing 
+    transportation-related expenses.""")
+
+
+# Dedented once here; dedenting after the email is interpolated also has to
+# scan its content, and any unindented content line stops the dedent altogether
+EXPENSE_PROMPT_TEMPLATE = dedent("""
+    Analyze this Ola/Uber receipt email and extract key information.
+    Email details:
+    - Sender: {sender}
+    - Recipient: {receiver}
+    - Subject: "{subject}"
+    - Content: "{content}"
+    - Email Date : "{date}"
+    - Message ID: {email_id}
+    
+    Format your response as a JSON object with:
+    {{
+        "email_id": message ID,
+        "vendor" : "ola" or "uber",
+        "subject": subject line,
+        "date": expense date (YYYY-MM-DD format),
+        "payment_mode": payment method used,
+        "expense_amount": amount in currency (e.g. "₹123.45"),
+        "expense_details": brief description of pickup/dropoff,
+        "email_date": email received date,
+        "email_recipient": recipient address,
+        "email_sender": sender address
+    }}
+    
+    Extract only factual information present in the email. If any field cannot be determined, use null.
+""")
+
+
+def _expense_prompt(emails):
+    """Builds the expense extraction instructions for one queued email."""
+    return EXPENSE_PROMPT_TEMPLATE.format(
+        sender=emails['sender'],
+        receiver=emails['receiver'],
+        subject=emails['subject'],
+        content=emails['content'],
+        date=emails['date'],
+        email_id=emails["email_id"],
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_openai_client():
+    """Returns the OpenAI client shared by every extraction.
+
+    Its connection pool is shared by the concurrent extraction threads, and HTTP/2
+    lets their requests share connections instead of each opening its own.
+    """
+    http_client = DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=httpx.Timeout(OPENAI_TIMEOUT),
+    )
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client)
+
+
+_backoff = tenacity.wait_exponential_jitter(initial=1, max=RETRY_MAX_WAIT)
+
+
+def _wait_for_retry(retry_state):
+    """Waits as long as a rate limit's retry-after header asks, up to RETRY_MAX_WAIT, else backs off exponentially."""
+    error = retry_state.outcome.exception()
+    if isinstance(error, RateLimitError):
+        try:
+            return min(float(error.response.headers.get("retry-after")), RETRY_MAX_WAIT)
+        except (TypeError, ValueError):
+            pass
+    return _backoff(retry_state)
+
+
+@tenacity.retry(
+    retry=tenacity.retry_if_exception_type(
+        (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+    ),
+    wait=_wait_for_retry,
+    stop=tenacity.stop_after_attempt(EXTRACT_ATTEMPTS),
+    reraise=True,
+)
+def _extract_expense(emails):
+    """Extracts the expense details of one queued email with a single chat completion.
+
+    Args:
+        emails (dict): The queued email data
+    Returns:
+        str: The JSON summary returned by the model
+    """
+    # The retry decorator handles retries, so the client doesn't retry as well
+    resp = _get_openai_client().with_options(max_retries=0).chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": EXPENSE_BACKSTORY},
+            {"role": "user", "content": _expense_prompt(emails)}
+        ],
+        response_format=EXPENSE_RESPONSE_FORMAT
+    )
+    return resp.choices[0].message.content
+
+
+async def _extract_expenses(batch, max_parallel):
+    """Runs the expense extraction for a batch of queued emails concurrently.
+
+    Args:
+        batch (list): (email_data, msg_id) tuples taken from the queue
+        max_parallel (int): Maximum number of LLM calls in flight at once
+    Returns:
+        list: (msg_id, summary) tuples in completion order; summary is None
+              if the extraction failed
+    """
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def extract(emails, msg_id):
+        async with semaphore:
+            try:
+                # The OpenAI client blocks, so run the call on a worker thread
+                return msg_id, await asyncio.to_thread(_extract_expense, emails)
+            except Exception as e:
+                print(f"Error processing email {msg_id}: {e}")
+                return msg_id, None
+
+    results = []
+    for finished in asyncio.as_completed([extract(emails, msg_id) for emails, msg_id in batch]):
+        results.append(await finished)
+    return results
+
+
+def _save_summaries(queue, summaries, msg_ids, processed_file):
+    """Saves processed summaries, then takes their emails off the queue.
+
+    The summaries are saved with a single insert, so if any of them is rejected
+    none are saved; the emails then stay queued to be processed again.
+
+    Args:
+        queue (str): The queue the emails were read from
+        summaries (list): Parsed expense summaries
+        msg_ids (list): Queue message IDs of the summarized emails
+        processed_file: Open file the summaries are appended to
+    Returns:
+        bool: True if the summaries were saved and their emails dequeued
+    """
+    if not summaries:
+        return True
+    if not save_processed_email(summaries):
+        print(f"Saving {len(summaries)} summaries failed, leaving their emails queued")
+        return False
+    for summary in summaries:
+        processed_file.write(json.dumps(summary) + "\n")
+    processed_file.flush()
+    remove_emails_from_queue(queue, msg_ids)
+    return True
+
+
+def fetch_and_process_email_batch(queue):
+    """Processes all emails in the queue with a single OpenAI Batch API job.
+
+    Args:
+        queue (str): The name of the queue to process emails from
+    Returns:
+        bool: True if the batch completed and its results were saved
+    """
+    # Drain the queue, claiming each email for the lifetime of the job so other
+    # runs and concurrent crews don't submit it again
+    batch={}
+    while True:
+        new_emails={msg_id: emails for emails,msg_id in fetch_emails_from_queue(queue, SAVE_BATCH_SIZE, BATCH_VISIBILITY_TIMEOUT)
+                    if msg_id not in batch}
+        if not new_emails:
+            break
+        batch.update(new_emails)
+
+    if not batch:
+        print("No more emails to process")
+        return True
+
+    # One chat completion request per email, identified by its queue message id
+    requests=[
+        json.dumps({
+            "custom_id": str(msg_id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "gpt-4o-mini",
+                "messages": [
+                    {"role": "system", "content": EXPENSE_BACKSTORY},
+                    {"role": "user", "content": _expense_prompt(emails)}
+                ],
+                "response_format": EXPENSE_RESPONSE_FORMAT
+            }
+        })
+        for msg_id,emails in batch.items()
+    ]
+
+    client = _get_openai_client()
+    batch_file = client.files.create(
+        file=("expense_batch.jsonl", "\n".join(requests).encode("utf-8")),
+        purpose="batch"
+    )
+    job = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    print(f"Submitted batch {job.id} with {len(batch)} emails")
+
+    while job.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_INTERVAL)
+        job = client.batches.retrieve(job.id)
+
+    if job.status != "completed" or not job.output_file_id:
+        print(f"Batch {job.id} ended with status {job.status}")
+        return False
+
+    msg_ids={str(msg_id): msg_id for msg_id in batch}
+    summaries=[]
+    processed_ids=[]
+    processed_count=0
+    # Stream the results and save them as they are read; failed emails stay queued
+    with client.files.with_streaming_response.content(job.output_file_id) as output, \
+            open(PROCESSED_EMAILS_FILE, "a") as processed_file:
+        for line in output.iter_lines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            if response.get("status_code") != 200:
+                print(f"Request {result['custom_id']} failed: {result.get('error')}")
+                continue
+
+            summary = response["body"]["choices"][0]["message"]["content"]
+            try:
+                summaries.append(json.loads(summary))
+            except json.JSONDecodeError as e:
+                print(f"Error parsing JSON summary: {e}")
+                print(f"Raw summary: {summary}")
+                continue
+            processed_ids.append(msg_ids[result["custom_id"]])
+
+            if len(summaries) >= SAVE_BATCH_SIZE:
+                if _save_summaries(queue, summaries, processed_ids, processed_file):
+                    processed_count += len(processed_ids)
+                summaries=[]
+                processed_ids=[]
+
+        if _save_summaries(queue, summaries, processed_ids, processed_file):
+            processed_count += len(processed_ids)
+
+    print(f"Batch {job.id} processed {processed_count} of {len(batch)} emails")
+    return True
+
+
 class EmailTools:
 
 
@@ -54,7 +383,7 @@ class EmailTools:
             print(f"Error getting analytics: {str(e)}")
             return {}
         
-    # Tool to process one email per agent
+    # Tool to process the queued emails, several agents at a time
     @tool("Process emails from the expense agent queue")
     def fetch_and_process_email(queue:str)->bool:
 
@@ -67,113 +396,47 @@ class EmailTools:
         Returns:
             bool: A status message indicating success or failure"""
         
-        processed_count = 0
         print("fetch_and_process_email",queue)
-        summaries=[]
         try:
-            while True:
-                emails,msg_id = fetch_and_process_email("email_processor_expenseagent_queue")
-                
-                
-                #print(msg_id)
-                #continue
-                if emails!=None and len(emails)>0:
-                    email_id=emails["email_id"]
-                    #print(f"processing emails {emails['subject']} --- {email_id}")
-                    subject=emails['subject']
-                    content=emails['content']
-                    date1=emails['date']
-
-                    agent2 = Agent(
-                        role="Expense Manager Agent",
-                        goal="Review the subject of each email if it belongs to ola or uber , review the subject and contents of the email to determine if it corresponds trip details including date , payment mode , expense ammount",
-                        backstory=dedent("""\
-                            As an experienced expense management specialist, I have extensive expertise in 
-                            analyzing ride-sharing receipts and travel expenses. I'm trained to quickly 
-                            identify and extract key information from Uber and Ola emails, including trip 
-                            dates, payment details, and expense amounts. My background includes years of 
-                            working with corporate expense management systems and automated receipt 
-                            processing, making me highly efficient at categorizing and organizing 
-                            transportation-related expenses."""),
-                            llm=ChatOpenAI(api_key=os.getenv("OPENAI_API_KEY"),
-					            model_name="gpt-4o-mini"
-		                    ),
-                        allow_delegation=False,
-                        verbose=True,
-                        return_direct=True
-                    )
-                    task = Task(
-                        agent=agent2,
-                        expected_output="json",
-                        description=dedent(f"""
-                            Analyze this Ola/Uber receipt email and extract key information.
-                            Email details:
-                            - Sender: {emails['sender']}
-                            - Recipient: {emails['receiver']}
-                            - Subject: "{subject}"
-                            - Content: "{content}"
-                            - Email Date : "{date1}"
-                            - Message ID: {email_id}
-                            
-                            Format your response as a JSON object with:
-                            {{
-                                "email_id": message ID,
-                                "vendor" : "ola" or "uber",
-                                "subject": subject line,
-                                "date": expense date (YYYY-MM-DD format),
-                                "payment_mode": payment method used,
-                                "expense_amount": amount in currency (e.g. "₹123.45"),
-                                "expense_details": brief description of pickup/dropoff,
-                                "email_date": email received date,
-                                "email_recipient": recipient address,
-                                "email_sender": sender address
-                            }}
-                            
-                            Extract only factual information present in the email. If any field cannot be determined, use null.
-                        """)
-
-                    )
-                    task_output = task.execute_sync()
-
-                    if not task_output:
-                        break;
-                        # Accessing the task output
-                    
-                    summary=task_output.raw
-
-                    # Clean the JSON string by removing trailing ``` and whitespace
-                    summary = summary.strip()
-                    if summary.endswith('```'):
-                        summary = summary[:-3].strip()
-                    if summary.startswith('```json'):
-                        summary = summary[7:].strip()
-
-                    # Parse the JSON string into a Python object
-                    try:
-                        json_summary = json.loads(summary)
+            if BATCH_MODE:
+                return fetch_and_process_email_batch("email_processor_expenseagent_queue")
+
+            with open(PROCESSED_EMAILS_FILE, "a") as processed_file:
+                while True:
+                    batch = fetch_emails_from_queue("email_processor_expenseagent_queue", EXPENSE_BATCH_SIZE, EXPENSE_VISIBILITY_TIMEOUT)
+
+                    if not batch:
+                        print("No more emails to process")
+                        break
+
+                    summaries=[]
+                    processed_ids=[]
+                    failed=False
+                    for msg_id,summary in asyncio.run(_extract_expenses(batch, MAX_PARALLEL_AGENTS)):
+                        if not summary:
+                            failed=True
+                            continue
+
+                        # Parse the JSON string into a Python object
+                        try:
+                            json_summary = json.loads(summary)
+                        except json.JSONDecodeError as e:
+                            print(f"Error parsing JSON summary: {e}")
+                            print(f"Raw summary: {summary}")
+                            failed=True
+                            continue
+
+                        print("processing summary is ",json_summary)
                         summaries.append(json_summary)
-                        
-                        remove_email_from_queue("email_processor_expenseagent_queue", msg_id)
-                        print("processing summary is ",summary)
-                        save_processed_email([json_summary])
-
-                    except json.JSONDecodeError as e:
-                        print(f"Error parsing JSON summary: {e}")
-                        print(f"Raw summary: {summary}")
-                        break;
-                    # processed_count += 1
-                    # if processed_count == 2:
-                    #     break;
-                        
-                else:
-                    
-                    print("No more emails to process")
-                    break;
+                        processed_ids.append(msg_id)
 
-            # with open("processed_emails.json", "w") as file:
-            #             json.dump(summaries, file, indent=4)
-            
-            
+                    # Save the whole batch at once, then take it off the queue
+                    if not _save_summaries("email_processor_expenseagent_queue", summaries, processed_ids, processed_file):
+                        failed=True
+
+                    # Failed emails stay queued; stop instead of picking them up again
+                    if failed:
+                        break
 
             return True
         except Exception as e:
@@ -212,6 +475,9 @@ class EmailTools:
                     ])
                 else:
                     break;
+                # Stop after the last page instead of listing the inbox again
+                if next_page_token is None:
+                    break
             
             print("completed fetching all the emails ",fcount)
             o=TOutput(count=fcount)
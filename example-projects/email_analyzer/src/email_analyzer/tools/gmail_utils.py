@@ -4,8 +4,13 @@ import base64
 
 import json
 import sqlite3  # Replace rocksdb with sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
 import re  # Add this import for regular expressions
-from bs4 import BeautifulSoup  # Add this import for BeautifulSoup
+from collections import namedtuple
+from selectolax.lexbor import LexborHTMLParser
 
 from simplegmail import Gmail
 from simplegmail.query import construct_query
@@ -19,6 +24,117 @@ This module provides functionality for:
 - Handling email data caching
 """
 
+DB_PATH = "email_cache.db"
+
+# Collapses every run of whitespace in extracted email text to a single space
+_WS_RE = re.compile(r'\s+')
+
+# Elements whose contents aren't readable text; selectolax would include them
+_NON_TEXT_TAGS = ['style', 'script', 'noscript', 'template']
+
+_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS emails (
+        msg_id TEXT PRIMARY KEY,
+        email_data BLOB
+    )
+    ''',
+    # Queue rows reference the cached email instead of carrying their own copy,
+    # and are popped in rowid order, which only ever grows with each insert
+    # (databases created before this keep their unused email_data and counter columns)
+    '''
+    CREATE TABLE IF NOT EXISTS email_queue (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        queue_name TEXT,
+        msg_id TEXT REFERENCES emails (msg_id),
+        UNIQUE (queue_name, msg_id)
+    )
+    ''',
+    # Lets the FIFO pops read the oldest rows of a queue without sorting it;
+    # the index keeps the rowid after queue_name, so it is already in FIFO order
+    '''
+    CREATE INDEX IF NOT EXISTS idx_email_queue_order
+    ON email_queue (queue_name)
+    ''',
+    # Queue positions used to be tracked in a separate counters table
+    'DROP TABLE IF EXISTS counters',
+    '''
+    CREATE TABLE IF NOT EXISTS checkpoints (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''',
+)
+
+# Queue and cache statements, kept as constants so sqlite3's statement cache
+# reuses their compiled form
+_SQL_POP = """
+    SELECT q.msg_id, e.email_data FROM email_queue q
+    JOIN emails e ON e.msg_id = q.msg_id
+    WHERE q.queue_name = ?
+    ORDER BY q.rowid ASC LIMIT 1
+"""
+_SQL_POP_BATCH = """
+    SELECT q.msg_id, e.email_data FROM email_queue q
+    JOIN emails e ON e.msg_id = q.msg_id
+    WHERE q.queue_name = ?
+    ORDER BY q.rowid ASC LIMIT ?
+"""
+_SQL_ENQUEUE = "INSERT INTO email_queue (queue_name, msg_id) VALUES (?, ?)"
+_SQL_DEQUEUE = "DELETE FROM email_queue WHERE queue_name = ? AND msg_id = ?"
+_SQL_GET_EMAILS = "SELECT msg_id, email_data FROM emails WHERE msg_id IN ({})"
+_SQL_INSERT_EMAIL = "INSERT OR IGNORE INTO emails (msg_id, email_data) VALUES (?, ?)"
+_SQL_GET_CHECKPOINT = "SELECT value FROM checkpoints WHERE key = ?"
+_SQL_SET_CHECKPOINT = "INSERT OR REPLACE INTO checkpoints (key, value) VALUES (?, ?)"
+
+# Partial response for message lists: only the references and the next page token
+_MESSAGE_LIST_FIELDS = 'messages(id,threadId),nextPageToken'
+
+# IDs bound per cache lookup, kept under SQLite's default limit of 999 variables
+CACHE_LOOKUP_BATCH_SIZE = 500
+
+# messages.get calls per Gmail batch request; Gmail starts rate limiting above 50
+GMAIL_BATCH_SIZE = 50
+
+# Extra attempts for messages a batch request failed with a rate limit or server
+# error; the wait doubles from GMAIL_RETRY_DELAY seconds between attempts
+GMAIL_BATCH_RETRIES = 3
+GMAIL_RETRY_DELAY = 1.0
+
+# The parts of a downloaded Gmail message that emails are built from
+GmailMessage = namedtuple('GmailMessage', 'id thread_id internal_date headers html plain')
+
+# sqlite3 connections can't be shared between threads, so each thread keeps its own
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def _get_conn():
+    """Returns this thread's connection to the email cache database.
+    
+    The connection is opened on first use with WAL journaling, so readers don't
+    block the writer, and the tables are created once per process.
+    
+    Returns:
+        sqlite3.Connection: The open database connection
+    """
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")  # 64 MB
+        with _schema_lock:
+            if not _schema_ready:
+                for statement in _SCHEMA:
+                    conn.execute(statement)
+                conn.commit()
+                _schema_ready = True
+        _local.conn = conn
+    return conn
+
 def get_gmail_service(email=None):
     """Creates and returns a Gmail API service object.
     
@@ -32,27 +148,223 @@ def get_gmail_service(email=None):
     gmail = Gmail(creds_file=creds_path, delegated_email=email)
     return gmail
 
-def remove_email_from_queue(queue_name, msg_id):
-    """Removes an email from the queue and updates associated counters.
+# Gmail clients reused across fetches, keyed by the delegated email address.
+# The service object and its httplib2 connection aren't thread-safe, so every
+# thread (crews run concurrently in worker threads) keeps its own.
+_gmail_local = threading.local()
+
+def _get_gmail(email=None):
+    """Returns the calling thread's Gmail service object for an email address.
+    
+    Building one loads the credentials and the API discovery document, so it is
+    done once per address and thread rather than on every fetch.
     
     Args:
-        queue_name (str): Name of the queue to remove email from
-        msg_id (str): ID of the email message to remove
+        email (str, optional): The delegated email address to access. Defaults to None.
+        
+    Returns:
+        Gmail: An authenticated Gmail service object.
     """
-    conn = sqlite3.connect("email_cache.db")
-    cursor = conn.cursor()
+    services = getattr(_gmail_local, 'services', None)
+    if services is None:
+        services = _gmail_local.services = {}
+    gmail = services.get(email)
+    if gmail is None:
+        gmail = services[email] = get_gmail_service(email=email)
+    return gmail
+
+def _list_message_ids(gmail, email, query):
+    """Lists the IDs of every message matching a Gmail query.
     
-    # Delete the message from the queue
-    cursor.execute("DELETE FROM email_queue WHERE queue_name = ? AND msg_id = ?", 
-                  (queue_name, msg_id))
+    Only the message list is requested, one call per page, so cached messages
+    never have their bodies downloaded.
     
-    # Decrement the counter
-    counter_key = f"{queue_name}:counter"
-    cursor.execute("UPDATE counters SET counter_value = counter_value - 1 WHERE counter_key = ?", 
-                  (counter_key,))
+    Args:
+        gmail (Gmail): Authenticated Gmail service object
+        email (str): Email address the messages belong to
+        query (str): Gmail query to match
+        
+    Returns:
+        list: Message references with keys id and threadId, newest first
+    """
+    messages = gmail.service.users().messages()
+    list_params = {
+        'userId': email,
+        'q': query,
+        'maxResults': 500,  # the largest page Gmail returns
+        'fields': _MESSAGE_LIST_FIELDS,
+    }
+    response = messages.list(**list_params).execute()
+    message_refs = list(response.get('messages', []))
+    while response.get('nextPageToken'):
+        response = messages.list(pageToken=response['nextPageToken'], **list_params).execute()
+        message_refs.extend(response.get('messages', []))
+    return message_refs
+
+def _format_message(message):
+    """Converts a Gmail message into the email dictionary stored in the queues.
+    
+    Args:
+        message (GmailMessage): Message downloaded from Gmail
+        
+    Returns:
+        dict: Email with id, subject, sender, receiver, body, content, date and threadId
+    """
+    # Extract message headers
+    headers = message.headers
+    subject = headers.get("Subject", 'No Subject')
+    sender = headers.get("From", 'Unknown')
+    receiver = headers.get("To", 'Unknown')
+    date = headers.get("Date", 'Unknown')
+
+    # Extract and clean message content; plain-text emails have nothing to parse
+    if not message.html:
+        text_content = message.plain
+    else:
+        try:
+            tree = LexborHTMLParser(message.html)
+            tree.strip_tags(_NON_TEXT_TAGS, recursive=True)
+            body = tree.body
+            text_content = body.text(separator=' ', strip=True) if body is not None else ''
+            text_content = _WS_RE.sub(' ', text_content).strip()
+        except Exception as e:
+            text_content = message.plain
+
+    # Create message format structure
+    return {
+        'id': message.id,
+        'subject': subject,
+        'sender': sender,
+        'receiver': receiver,
+        'body': message.html,
+        'content': text_content,
+        'date': date,
+        'internal_date': message.internal_date,
+        'threadId': message.thread_id
+    }
+
+def _is_retryable(error):
+    """Whether a failed Gmail request may succeed if sent again (429 or 5xx)."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 429 or status >= 500
+
+def _get_messages(gmail, email, message_refs):
+    """Downloads several Gmail messages using batch requests.
+    
+    Up to GMAIL_BATCH_SIZE messages.get calls are sent in each HTTP request,
+    and the payloads are decoded the same way simplegmail decodes them.
+    Individual calls in a batch can fail with rate limit or server errors;
+    those messages are requested again with backoff, and messages that still
+    fail are logged and left out.
+    
+    Args:
+        gmail (Gmail): Authenticated Gmail service object
+        email (str): Email address the messages belong to
+        message_refs (list): Message references with keys id and threadId
+        
+    Returns:
+        list: GmailMessage tuples in the same order as message_refs, without
+        the messages that could not be downloaded
+    """
+    service = gmail.service
+    raw_messages = {}
+    errors = {}
+    
+    def collect(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            raw_messages[request_id] = response
+    
+    pending = list(message_refs)
+    for attempt in range(GMAIL_BATCH_RETRIES + 1):
+        if attempt:
+            time.sleep(GMAIL_RETRY_DELAY * 2 ** (attempt - 1))
+        errors.clear()
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=collect)
+            for ref in pending[start:start + GMAIL_BATCH_SIZE]:
+                batch.add(service.users().messages().get(userId=email, id=ref['id']), request_id=ref['id'])
+            batch.execute()
+        
+        # Only rate limits and server errors are worth another attempt
+        retryable = [ref for ref in pending if ref['id'] in errors and _is_retryable(errors[ref['id']])]
+        for ref in pending:
+            if ref['id'] in errors and not _is_retryable(errors[ref['id']]):
+                print(f"Skipping message {ref['id']}: {errors[ref['id']]}")
+        pending = retryable
+        if not pending:
+            break
+    for ref in pending:
+        print(f"Skipping message {ref['id']} after {GMAIL_BATCH_RETRIES} retries: {errors[ref['id']]}")
+    
+    messages = []
+    for ref in message_refs:
+        raw = raw_messages.get(ref['id'])
+        if raw is None:
+            continue
+        payload = raw['payload']
+        parts = gmail._evaluate_message_payload(payload, email, raw['id'], attachments='ignore')
+        plain_parts = [part['body'] for part in parts if part['part_type'] == 'plain']
+        html_parts = [part['body'] for part in parts if part['part_type'] == 'html']
+        messages.append(GmailMessage(
+            id=raw['id'],
+            thread_id=raw['threadId'],
+            internal_date=int(raw['internalDate']) if raw.get('internalDate') else None,
+            headers={header['name']: header['value'] for header in payload.get('headers', [])},
+            html='<br/>'.join(html_parts) if html_parts else None,
+            plain='\n'.join(plain_parts) if plain_parts else None,
+        ))
+    return messages
+
+def _encode_email(email):
+    """Serializes an email dictionary for the cache as zlib-compressed JSON."""
+    return zlib.compress(json.dumps(email).encode('utf-8'))
+
+def _decode_email(email_data):
+    """Deserializes a cached email, including ones stored as plain JSON text by older versions."""
+    if isinstance(email_data, str):
+        return json.loads(email_data)
+    return json.loads(zlib.decompress(email_data))
+
+def _queue_payload(email):
+    """Returns the email as queue consumers see it, without its raw HTML body.
+    
+    The body stays in the cache; consumers work from the extracted text content.
+    """
+    return {k: v for k, v in email.items() if k != 'body'}
+
+def _get_cached_emails(cursor, msg_ids):
+    """Looks up several emails in the cache with one query per batch of IDs.
     
+    Args:
+        cursor (sqlite3.Cursor): Cursor on the email cache database
+        msg_ids (list): IDs of the email messages to look up
+        
+    Returns:
+        dict: Cached email dictionaries keyed by message ID; missing IDs are left out
+    """
+    cached = {}
+    for start in range(0, len(msg_ids), CACHE_LOOKUP_BATCH_SIZE):
+        batch = msg_ids[start:start + CACHE_LOOKUP_BATCH_SIZE]
+        cursor.execute(_SQL_GET_EMAILS.format(','.join('?' * len(batch))), batch)
+        cached.update((msg_id, _decode_email(email_data)) for msg_id, email_data in cursor.fetchall())
+    return cached
+
+def remove_email_from_queue(queue_name, msg_id):
+    """Removes an email from the queue.
+    
+    Args:
+        queue_name (str): Name of the queue to remove email from
+        msg_id (str): ID of the email message to remove
+    """
+    conn = _get_conn()
+    conn.execute(_SQL_DEQUEUE, (queue_name, msg_id))
     conn.commit()
-    conn.close()
 
 def fetch_and_process_email(queue_name):
     """Fetches and processes the oldest email from a specified queue.
@@ -64,57 +376,49 @@ def fetch_and_process_email(queue_name):
         tuple: (email_data, msg_id) if email exists, (None, None) otherwise
         where email_data is the JSON-decoded email content
     """
-    # Open SQLite database connection
-    conn = sqlite3.connect("email_cache.db")
-    cursor = conn.cursor()
+    cursor = _get_conn().cursor()
     
-    # Create tables if they don't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS email_queue (
-        queue_name TEXT,
-        msg_id TEXT,
-        counter INTEGER,
-        email_data TEXT,
-        PRIMARY KEY (queue_name, msg_id)
-    )
-    ''')
-    
-    # Create counters table for tracking queue positions
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS counters (
-        counter_key TEXT PRIMARY KEY,
-        counter_value INTEGER
-    )
-    ''')
+    # Get the oldest message (lowest rowid)
+    cursor.execute(_SQL_POP, (queue_name,))
     
-    # Get the counter key for this queue
-    counter_key = f"{queue_name}:counter"
-    cursor.execute("SELECT counter_value FROM counters WHERE counter_key = ?", (counter_key,))
     result = cursor.fetchone()
-    
     if not result:
-        conn.close()
         return None,None
     
-    # Get the oldest message (lowest counter value)
-    cursor.execute("""
-        SELECT msg_id, email_data, counter FROM email_queue 
-        WHERE queue_name = ? 
-        ORDER BY counter ASC LIMIT 1
-    """, (queue_name,))
-    
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return None,None
-    
-    msg_id, email_data, counter = result
-    conn.close()
+    msg_id, email_data = result
     
     # Remove the email from queue
     #remove_email_from_queue(queue_name, msg_id)
     
-    return json.loads(email_data),msg_id
+    return _queue_payload(_decode_email(email_data)),msg_id
+
+def fetch_emails_from_queue(queue_name, batch_size=32):
+    """Fetches the oldest emails from a specified queue in a single query.
+    
+    The emails stay in the queue until they are removed with
+    remove_emails_from_queue, so a failed batch can be processed again.
+    
+    Args:
+        queue_name (str): Name of the queue to fetch from
+        batch_size (int): Maximum number of emails to fetch
+        
+    Returns:
+        list: (email_data, msg_id) tuples in FIFO order, empty if the queue is empty
+    """
+    cursor = _get_conn().cursor()
+    cursor.execute(_SQL_POP_BATCH, (queue_name, batch_size))
+    return [(_queue_payload(_decode_email(email_data)), msg_id) for msg_id, email_data in cursor.fetchall()]
+
+def remove_emails_from_queue(queue_name, msg_ids):
+    """Removes several emails from the queue in one transaction.
+    
+    Args:
+        queue_name (str): Name of the queue to remove emails from
+        msg_ids (list): IDs of the email messages to remove
+    """
+    conn = _get_conn()
+    conn.executemany(_SQL_DEQUEUE, [(queue_name, msg_id) for msg_id in msg_ids])
+    conn.commit()
 
 def push_unique_emails_to_queues(emails, agent_queues):
     """Pushes unique emails to multiple agent queues in FIFO order.
@@ -126,75 +430,63 @@ def push_unique_emails_to_queues(emails, agent_queues):
     Returns:
         str: Status message with count of new emails pushed
     """
-    new_count = 0
-    
-    # Open SQLite database connection
-    conn = sqlite3.connect("email_cache.db")
+    conn = _get_conn()
     cursor = conn.cursor()
     
-    # Create tables if they don't exist
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS emails (
-        msg_id TEXT PRIMARY KEY,
-        email_data TEXT
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS email_queue (
-        queue_name TEXT,
-        msg_id TEXT,
-        counter INTEGER,
-        email_data TEXT,
-        PRIMARY KEY (queue_name, msg_id)
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS counters (
-        counter_key TEXT PRIMARY KEY,
-        counter_value INTEGER
-    )
-    ''')
-    
-    for email in emails:
-        msg_id = email['id']
-        print("checking emails ", msg_id)
-        # Check for duplicate messages
-        cursor.execute("SELECT 1 FROM emails WHERE msg_id = ?", (msg_id,))
-        r1 = cursor.fetchone()
+    # Take the write lock up front so the cache and every queue are updated together
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        new_emails = []
+        for email in emails:
+            msg_id = email['id']
+            print("checking emails ", msg_id)
+            # Cache the email; it's only new, and queued, if it wasn't cached already
+            cursor.execute(_SQL_INSERT_EMAIL, (msg_id, _encode_email(email)))
+            if cursor.rowcount == 1:
+                new_emails.append(email)
+        
+        # Add to each agent's queue; rows are inserted in order, so their rowids keep it FIFO
+        for queue in agent_queues:
+            if not new_emails:
+                break
+            cursor.executemany(_SQL_ENQUEUE, [(queue, email['id']) for email in new_emails])
         
-        if r1:  # If email exists
-            # Convert email to JSON for storage
-            email_json = json.dumps(email)
-            
-            # Add to each agent's queue with FIFO ordering
-            for queue in agent_queues:
-                # Maintain FIFO order using counter
-                counter_key = f"{queue}:counter"
-                cursor.execute("SELECT counter_value FROM counters WHERE counter_key = ?", (counter_key,))
-                result = cursor.fetchone()
-                
-                if not result:
-                    counter_value = 0
-                    cursor.execute("INSERT INTO counters (counter_key, counter_value) VALUES (?, ?)", 
-                                  (counter_key, 1))
-                else:
-                    counter_value = result[0]
-                    cursor.execute("UPDATE counters SET counter_value = ? WHERE counter_key = ?", 
-                                  (counter_value + 1, counter_key))
-                
-                cursor.execute("""
-                    INSERT INTO email_queue (queue_name, msg_id, counter, email_data) 
-                    VALUES (?, ?, ?, ?)
-                """, (queue, msg_id, counter_value, email_json))
-                
-            new_count += 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     
-    conn.commit()
-    conn.close()
+    new_count = len(new_emails)
     return f"{new_count} new emails pushed to {len(agent_queues)} queues as FIFO."
 
+def _checkpoint_key(email, senders):
+    """Returns the checkpoint key for one mailbox and sender filter.
+    
+    Crews for different senders run concurrently, so each keeps its own
+    checkpoint; a shared one would skip emails the others haven't fetched yet.
+    """
+    senders = senders if isinstance(senders, str) else ','.join(senders)
+    return f"last_fetch_checkpoint:{email}:{senders}"
+
+def _newest_email_date(emails):
+    """Returns the date of the newest email in Gmail query format (YYYY/MM/DD).
+    
+    Uses the time Gmail received each email rather than its Date header, which
+    the sender controls; one future-dated email would otherwise move the
+    checkpoint past every real email before that date.
+    
+    Args:
+        emails (list): Email dictionaries with Gmail's internalDate, in
+            milliseconds since the epoch, under 'internal_date'
+        
+    Returns:
+        str: The newest date, or None if no email has an internal date
+    """
+    timestamps = [email['internal_date'] for email in emails if email.get('internal_date')]
+    if not timestamps:
+        return None
+    return datetime.fromtimestamp(max(timestamps) / 1000, tz=timezone.utc).strftime('%Y/%m/%d')
+
 def fetch_emails(email, filter, start_date, count, page_token=None):
     """Fetches and processes emails from Gmail inbox with caching.
     
@@ -207,28 +499,12 @@ def fetch_emails(email, filter, start_date, count, page_token=None):
         
     Returns:
         tuple: (emails_list, next_page_token) or (None, None) on error
-        where emails_list contains processed email dictionaries
+        where emails_list contains processed email dictionaries; it is empty
+        when every matching email is cached already
     """
     try:
-        emails = []
-        # Initialize database connection and create tables
-        conn = sqlite3.connect("email_cache.db")
+        conn = _get_conn()
         cursor = conn.cursor()
-        
-        # Set up database tables for caching
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS emails (
-            msg_id TEXT PRIMARY KEY,
-            email_data TEXT
-        )
-        ''')
-        
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS checkpoints (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-        ''')
 
         # Process checkpoint date
         pstart_date = start_date
@@ -236,7 +512,7 @@ def fetch_emails(email, filter, start_date, count, page_token=None):
         
         try:
             # Retrieve last checkpoint
-            cursor.execute("SELECT value FROM checkpoints WHERE key = ?", ('last_fetch_checkpoint',))
+            cursor.execute(_SQL_GET_CHECKPOINT, (_checkpoint_key(email, filter),))
             result = cursor.fetchone()
             if result:
                 start_date = result[0]
@@ -245,7 +521,7 @@ def fetch_emails(email, filter, start_date, count, page_token=None):
             print(f"Error retrieving checkpoint: {e}")
 
         # Initialize Gmail service
-        gmail = get_gmail_service(email=email)
+        gmail = _get_gmail(email)
         
         # Set up query parameters
         if start_date:
@@ -258,67 +534,36 @@ def fetch_emails(email, filter, start_date, count, page_token=None):
         
         # Fetch messages from Gmail
         query1 = construct_query(query_params_1)
-        messages = gmail.get_messages(query=query1, attachments="ignore", user_id=email)
-
-        # Process each message
-        for message in messages:
-            msg_id = message.id
-            
-            # Check cache first
-            cursor.execute("SELECT email_data FROM emails WHERE msg_id = ?", (msg_id,))
-            result = cursor.fetchone()
-            
-            if not result:  # If not in cache, process the message
-                # Extract message headers
-                headers = message.headers
-                subject = headers.get("Subject", 'No Subject')
-                sender = headers.get("From", 'Unknown')
-                receiver = headers.get("To", 'Unknown')
-                date = headers.get("Date", 'Unknown')
-
-                # Extract and clean message content
-                try:
-                    soup = BeautifulSoup(message.html, 'html.parser')
-                    text_content = soup.get_text(separator=' ', strip=True)
-                    text_content = re.sub(r'\n+', ' ', text_content) 
-                except Exception as e:
-                    text_content = message.plain
-
-                # Create message format structure
-                mf = {
-                    'id': msg_id,
-                    'subject': subject,
-                    'sender': sender,
-                    'receiver': receiver,
-                    'body': message.html,
-                    'content': text_content,
-                    'date': date,
-                    'threadId': message.thread_id
-                }
-                
-                # Cache the processed email
-                email_json = json.dumps(mf)
-                cursor.execute("INSERT INTO emails (msg_id, email_data) VALUES (?, ?)", 
-                              (msg_id, email_json))
-                emails.append(mf)
-            else:  # If in cache, use cached version
-                mf = json.loads(result[0])
-                emails.append(mf)
-
-        # Update checkpoint with current date
-        from datetime import datetime
-        current_date = datetime.now().strftime('%Y/%m/%d')
-        cursor.execute("INSERT OR REPLACE INTO checkpoints (key, value) VALUES (?, ?)", 
-                      ('last_fetch_checkpoint', current_date))
+        message_refs = _list_message_ids(gmail, email, query1)
+
+        # Serve cached messages directly and download the rest in batches
+        cached = _get_cached_emails(cursor, [ref['id'] for ref in message_refs])
+        missing_refs = [ref for ref in message_refs if ref['id'] not in cached]
+        
+        # Everything since the checkpoint is cached, and so already queued
+        if not missing_refs:
+            return [], None
+        
+        # The email is cached when it is pushed to the queues
+        fetched = {message.id: _format_message(message) for message in _get_messages(gmail, email, missing_refs)}
+        emails = [cached.get(ref['id']) or fetched[ref['id']] for ref in message_refs
+                  if ref['id'] in cached or ref['id'] in fetched]
+
+        # Move the checkpoint up to the newest new email, so the next run starts
+        # there; if some failed to download, keep it so the next run retries them
+        checkpoint_date = _newest_email_date(fetched.values())
+        if checkpoint_date and len(fetched) == len(missing_refs):
+            cursor.execute(_SQL_SET_CHECKPOINT, (_checkpoint_key(email, filter), checkpoint_date))
         
         conn.commit()
-        conn.close()
         return emails, None
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return None
+        # Don't leave a half-written transaction open on the shared connection
+        _get_conn().rollback()
+        return None, None
 
 
 
@@ -1,12 +1,15 @@
 import os
-import json
+import threading
+import time
+import orjson
 import re
-from bs4 import BeautifulSoup
-from datetime import datetime
-from supabase import create_client, Client
+from collections import namedtuple
+from selectolax.lexbor import LexborHTMLParser
+from datetime import datetime, timezone
+from supabase import Client
 from simplegmail import Gmail
 from simplegmail.query import construct_query
-from .supabase_queue import SupabaseQueue
+from .supabase_queue import SupabaseQueue, VISIBILITY_TIMEOUT, get_supabase_client
 
 """Gmail utility functions for email processing and queue management with Supabase.
 
@@ -17,14 +20,34 @@ This module provides functionality for:
 - Handling email data caching
 """
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv("SUPABASE_URL"),
-    os.getenv("SUPABASE_KEY")
-)
+# Initialize Supabase client, shared with the queue manager
+supabase: Client = get_supabase_client()
 
 # Initialize queue manager
-queue_manager = SupabaseQueue()
+queue_manager = SupabaseQueue(supabase)
+
+# Collapses every run of whitespace in extracted email text to a single space
+_WS_RE = re.compile(r'\s+')
+
+# Elements whose contents aren't readable text; selectolax would include them
+_NON_TEXT_TAGS = ['style', 'script', 'noscript', 'template']
+
+# Partial response for message lists: only the references and the next page token
+_MESSAGE_LIST_FIELDS = 'messages(id,threadId),nextPageToken'
+
+# messages.get calls per Gmail batch request; Gmail starts rate limiting above 50
+GMAIL_BATCH_SIZE = 50
+
+# Extra attempts for messages a batch request failed with a rate limit or server
+# error; the wait doubles from GMAIL_RETRY_DELAY seconds between attempts
+GMAIL_BATCH_RETRIES = 3
+GMAIL_RETRY_DELAY = 1.0
+
+# The parts of a downloaded Gmail message that emails are built from
+GmailMessage = namedtuple('GmailMessage', 'id thread_id internal_date headers html plain')
+
+# Message IDs per .in_() filter, keeping the request URL well under length limits
+IN_QUERY_BATCH_SIZE = 100
 
 
 def get_gmail_service(email=None):
@@ -33,6 +56,137 @@ def get_gmail_service(email=None):
     gmail = Gmail(creds_file=creds_path, delegated_email=email)
     return gmail
 
+# Gmail clients reused across fetches, keyed by the delegated email address.
+# The service object and its httplib2 connection aren't thread-safe, so every
+# thread (crews run concurrently in worker threads) keeps its own.
+_gmail_local = threading.local()
+
+def _get_gmail(email=None):
+    """Returns the calling thread's Gmail service object for an email address.
+    
+    Building one loads the credentials and the API discovery document, so it is
+    done once per address and thread rather than on every fetch.
+    
+    Args:
+        email (str, optional): The delegated email address to access. Defaults to None.
+        
+    Returns:
+        Gmail: An authenticated Gmail service object.
+    """
+    services = getattr(_gmail_local, 'services', None)
+    if services is None:
+        services = _gmail_local.services = {}
+    gmail = services.get(email)
+    if gmail is None:
+        gmail = services[email] = get_gmail_service(email=email)
+    return gmail
+
+def _list_message_ids(gmail, email, query):
+    """Lists the IDs of every message matching a Gmail query.
+    
+    Only the message list is requested, one call per page, so cached messages
+    never have their bodies downloaded.
+    
+    Args:
+        gmail (Gmail): Authenticated Gmail service object
+        email (str): Email address the messages belong to
+        query (str): Gmail query to match
+        
+    Returns:
+        list: Message references with keys id and threadId, newest first
+    """
+    messages = gmail.service.users().messages()
+    list_params = {
+        'userId': email,
+        'q': query,
+        'maxResults': 500,  # the largest page Gmail returns
+        'fields': _MESSAGE_LIST_FIELDS,
+    }
+    response = messages.list(**list_params).execute()
+    message_refs = list(response.get('messages', []))
+    while response.get('nextPageToken'):
+        response = messages.list(pageToken=response['nextPageToken'], **list_params).execute()
+        message_refs.extend(response.get('messages', []))
+    return message_refs
+
+def _is_retryable(error):
+    """Whether a failed Gmail request may succeed if sent again (429 or 5xx)."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 429 or status >= 500
+
+def _get_messages(gmail, email, message_refs):
+    """Downloads several Gmail messages using batch requests.
+    
+    Up to GMAIL_BATCH_SIZE messages.get calls are sent in each HTTP request,
+    and the payloads are decoded the same way simplegmail decodes them.
+    Individual calls in a batch can fail with rate limit or server errors;
+    those messages are requested again with backoff, and messages that still
+    fail are logged and left out.
+    
+    Args:
+        gmail (Gmail): Authenticated Gmail service object
+        email (str): Email address the messages belong to
+        message_refs (list): Message references with keys id and threadId
+        
+    Returns:
+        list: GmailMessage tuples in the same order as message_refs, without
+        the messages that could not be downloaded
+    """
+    service = gmail.service
+    raw_messages = {}
+    errors = {}
+    
+    def collect(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            raw_messages[request_id] = response
+    
+    pending = list(message_refs)
+    for attempt in range(GMAIL_BATCH_RETRIES + 1):
+        if attempt:
+            time.sleep(GMAIL_RETRY_DELAY * 2 ** (attempt - 1))
+        errors.clear()
+        for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=collect)
+            for ref in pending[start:start + GMAIL_BATCH_SIZE]:
+                batch.add(service.users().messages().get(userId=email, id=ref['id']), request_id=ref['id'])
+            batch.execute()
+        
+        # Only rate limits and server errors are worth another attempt
+        retryable = [ref for ref in pending if ref['id'] in errors and _is_retryable(errors[ref['id']])]
+        for ref in pending:
+            if ref['id'] in errors and not _is_retryable(errors[ref['id']]):
+                print(f"Skipping message {ref['id']}: {errors[ref['id']]}")
+        pending = retryable
+        if not pending:
+            break
+    for ref in pending:
+        print(f"Skipping message {ref['id']} after {GMAIL_BATCH_RETRIES} retries: {errors[ref['id']]}")
+    
+    messages = []
+    for ref in message_refs:
+        raw = raw_messages.get(ref['id'])
+        if raw is None:
+            continue
+        payload = raw['payload']
+        parts = gmail._evaluate_message_payload(payload, email, raw['id'], attachments='ignore')
+        plain_parts = [part['body'] for part in parts if part['part_type'] == 'plain']
+        html_parts = [part['body'] for part in parts if part['part_type'] == 'html']
+        messages.append(GmailMessage(
+            id=raw['id'],
+            thread_id=raw['threadId'],
+            internal_date=int(raw['internalDate']) if raw.get('internalDate') else None,
+            headers={header['name']: header['value'] for header in payload.get('headers', [])},
+            html='<br/>'.join(html_parts) if html_parts else None,
+            plain='\n'.join(plain_parts) if plain_parts else None,
+        ))
+    return messages
+
 def remove_email_from_queue(queue_name, msg_id):
     """Removes an email from the queue."""
     try:
@@ -62,15 +216,30 @@ def fetch_and_process_email(queue_name):
         return None, None
 
 
+def fetch_emails_from_queue(queue_name, batch_size=32, vt=VISIBILITY_TIMEOUT):
+    """Fetches up to batch_size of the oldest emails from a specified queue.
+    
+    The emails are read with a single call and stay hidden from other reads for
+    vt seconds, or until they are removed from the queue.
+    """
+    return [
+        (message["email_data"], msg_id)
+        for msg_id, message in queue_manager.read_batch(queue_name, batch_size, vt)
+        if message
+    ]
+
+def remove_emails_from_queue(queue_name, msg_ids):
+    """Removes several emails from the queue with a single call."""
+    return queue_manager.delete_batch(queue_name, msg_ids)
+
+
 def save_processed_email(emails):
     """Saves processed email data to the database."""
     try:
-        # Save processed email data
-        for email in emails:
-            msg_id=email['email_id']
-            email_json = email
-
-            supabase.table('processed_emails').insert({'msg_id': msg_id, 'email_data': email_json}).execute()
+        # Save processed email data with a single bulk insert
+        rows = [{'msg_id': email['email_id'], 'email_data': email} for email in emails]
+        if rows:
+            supabase.table('processed_emails').insert(rows).execute()
         return True
     except Exception as e:
         print(f"Error saving processed email: {e}")
@@ -107,52 +276,131 @@ def get_cost_analytics():
 
     
 
+def _existing_msg_ids(msg_ids):
+    """Returns which of the given message IDs are in the emails table, one query per batch of IDs."""
+    existing = set()
+    for start in range(0, len(msg_ids), IN_QUERY_BATCH_SIZE):
+        batch = msg_ids[start:start + IN_QUERY_BATCH_SIZE]
+        result = supabase.table('emails').select('msg_id').in_('msg_id', batch).execute()
+        existing.update(row['msg_id'] for row in result.data)
+    return existing
+
 def push_unique_emails_to_queues(emails, agent_queues):
     """Pushes unique emails to multiple agent queues."""
     new_count = 0
     
     try:
+        # Check for duplicate messages
+        existing = _existing_msg_ids([email['id'] for email in emails])
+        
+        message_payloads = []
         for email in emails:
             msg_id = email['id']
             #print("checking emails ", msg_id)
             
-            # Check for duplicate messages
-            result = supabase.table('emails').select('msg_id').eq('msg_id', msg_id).execute()
-            
-            if result.data:  # If email exists
-                email_json = json.dumps(email)
+            if msg_id in existing:  # If email exists
                 email['email_id'] = msg_id
-                # Add to each agent's queue
-                for queue in agent_queues:
-                    message_payload = {
-                        #'msg_id': msg_id,
-                        'email_data': email,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    
-                    # Use queue manager to enqueue message
-                    queue_manager.enqueue(queue, message_payload)
-                
+                # The HTML body stays in the emails table; consumers only need the text content
+                queue_email = {k: v for k, v in email.items() if k != 'body'}
+                message_payloads.append({
+                    #'msg_id': msg_id,
+                    'email_data': queue_email,
+                    'timestamp': datetime.now().isoformat()
+                })
                 new_count += 1
         
+        # Add them to each agent's queue with a single call per queue
+        for queue in agent_queues:
+            queue_manager.enqueue_batch(queue, message_payloads)
+        
         return f"{new_count} new emails pushed to {len(agent_queues)} queues."
     
     except Exception as e:
         print(f"Error pushing emails to queues: {e}")
         return f"Error: {str(e)}"
 
+def _checkpoint_key(email, senders):
+    """Returns the checkpoint key for one mailbox and sender filter.
+    
+    Crews for different senders run concurrently, so each keeps its own
+    checkpoint; a shared one would skip emails the others haven't fetched yet.
+    """
+    senders = senders if isinstance(senders, str) else ','.join(senders)
+    return f"last_fetch_checkpoint:{email}:{senders}"
+
+def _newest_email_date(emails):
+    """Returns the date of the newest email in Gmail query format (YYYY/MM/DD).
+    
+    Uses the time Gmail received each email rather than its Date header, which
+    the sender controls; one future-dated email would otherwise move the
+    checkpoint past every real email before that date.
+    
+    Args:
+        emails (list): Email dictionaries with Gmail's internalDate, in
+            milliseconds since the epoch, under 'internal_date'
+        
+    Returns:
+        str: The newest date, or None if no email has an internal date
+    """
+    timestamps = [email['internal_date'] for email in emails if email.get('internal_date')]
+    if not timestamps:
+        return None
+    return datetime.fromtimestamp(max(timestamps) / 1000, tz=timezone.utc).strftime('%Y/%m/%d')
+
+def _process_message(message):
+    """Converts a Gmail message into the email dictionary that is cached and queued.
+    
+    Args:
+        message (GmailMessage): Message downloaded from Gmail
+        
+    Returns:
+        dict: The new email
+    """
+    msg_id = message.id
+    
+    # Extract message headers
+    headers = message.headers
+    subject = headers.get("Subject", 'No Subject')
+    sender = headers.get("From", 'Unknown')
+    receiver = headers.get("To", 'Unknown')
+    date = headers.get("Date", 'Unknown')
+
+    # Extract and clean message content; plain-text emails have nothing to parse
+    if not message.html:
+        text_content = message.plain
+    else:
+        try:
+            tree = LexborHTMLParser(message.html)
+            tree.strip_tags(_NON_TEXT_TAGS, recursive=True)
+            body = tree.body
+            text_content = body.text(separator=' ', strip=True) if body is not None else ''
+            text_content = _WS_RE.sub(' ', text_content).strip()
+        except Exception as e:
+            text_content = message.plain
+
+    # Create message format structure
+    return {
+        'id': msg_id,
+        'subject': subject,
+        'sender': sender,
+        'receiver': receiver,
+        'body': message.html,
+        'content': text_content,
+        'date': date,
+        'internal_date': message.internal_date,
+        'threadId': message.thread_id
+    }
+
 def fetch_emails(email, filter1, start_date, count, page_token=None):
     """Fetches and processes emails from Gmail inbox with caching."""
     try:
-        emails = []
-        
         # Process checkpoint date
         pstart_date = start_date
         start_date = None
         
         try:
             # Retrieve last checkpoint
-            result = supabase.table('checkpoints').select('value').eq('key', 'last_fetch_checkpoint').execute()
+            result = supabase.table('checkpoints').select('value').eq('key', _checkpoint_key(email, filter1)).execute()
             if result.data:
                 start_date = result.data[0]['value']
                 print(f"Using checkpoint date: {start_date}")
@@ -160,7 +408,7 @@ def fetch_emails(email, filter1, start_date, count, page_token=None):
             print(f"Error retrieving checkpoint: {e}")
 
         # Initialize Gmail service
-        gmail = get_gmail_service(email=email)
+        gmail = _get_gmail(email)
         
         # Set up query parameters
         if start_date:
@@ -185,61 +433,32 @@ def fetch_emails(email, filter1, start_date, count, page_token=None):
         
         # Fetch messages from Gmail
         query1 = construct_query(query_params_1)
-        messages = gmail.get_messages(query=query1, attachments="ignore", user_id=email)
+        message_refs = _list_message_ids(gmail, email, query1)
 
-        count=0
-        # Process each message
-        for message in messages:
-            msg_id = message.id
-            
-            # Check cache first
-            result = supabase.table('emails').select('email_data').eq('msg_id', msg_id).execute()
-            
-            if not result.data:  # If not in cache, process the message
-                # Extract message headers
-                headers = message.headers
-                subject = headers.get("Subject", 'No Subject')
-                sender = headers.get("From", 'Unknown')
-                receiver = headers.get("To", 'Unknown')
-                date = headers.get("Date", 'Unknown')
-
-                # Extract and clean message content
-                try:
-                    soup = BeautifulSoup(message.html, 'html.parser')
-                    text_content = soup.get_text(separator=' ', strip=True)
-                    text_content = re.sub(r'\n+', ' ', text_content) 
-                except Exception as e:
-                    text_content = message.plain
-
-                # Create message format structure
-                mf = {
-                    'id': msg_id,
-                    'subject': subject,
-                    'sender': sender,
-                    'receiver': receiver,
-                    'body': message.html,
-                    'content': text_content,
-                    'date': date,
-                    'threadId': message.thread_id
-                }
-                
-                # Cache the processed email
-                email_json = json.dumps(mf)
-                supabase.table('emails').insert({'msg_id': msg_id, 'email_data': email_json}).execute()
-                emails.append(mf)
-                
-            #else:  # If in cache, use cached version
-                #mf = json.loads(result.data[0]['email_data'])
-                #emails.append(mf)
+        # Check the cache for the whole page at once; cached emails have been queued already
+        cached = _existing_msg_ids([ref['id'] for ref in message_refs])
+        new_refs = [ref for ref in message_refs if ref['id'] not in cached]
+
+        # Download only the new messages in full
+        new_messages = _get_messages(gmail, email, new_refs)
+        emails = [_process_message(message) for message in new_messages]
 
+        # Cache the processed emails with a single bulk upsert
         if emails:
-            # Update checkpoint with current date
-            current_date = datetime.now().strftime('%Y/%m/%d')
-            supabase.table('checkpoints').upsert({'key': 'last_fetch_checkpoint', 'value': current_date}).execute()
+            supabase.table('emails').upsert(
+                [{'msg_id': mf['id'], 'email_data': orjson.dumps(mf).decode()} for mf in emails],
+                on_conflict='msg_id'
+            ).execute()
+
+        # Move the checkpoint up to the newest new email, so the next run starts
+        # there; if some failed to download, keep it so the next run retries them
+        checkpoint_date = _newest_email_date(emails)
+        if checkpoint_date and len(new_messages) == len(new_refs):
+            supabase.table('checkpoints').upsert({'key': _checkpoint_key(email, filter1), 'value': checkpoint_date}).execute()
             
         return emails, None
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return None
\ No newline at end of file
+        return None, None
\ No newline at end of file
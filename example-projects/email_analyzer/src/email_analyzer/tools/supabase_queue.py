@@ -12,6 +12,7 @@ transaction, preventing race conditions in multi-threaded environments.
 
 Features:
     - Basic queue operations (enqueue, dequeue, peek)
+    - Batch enqueueing
     - Batch message processing
     - Dead-letter queue (DLQ) support
     - Queue status monitoring
@@ -45,11 +46,48 @@ Example:
 """
 
 import os
-import json
+import orjson
+import functools
+import httpx
 from typing import Optional, Any, Dict, List
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 import datetime
 
+# Timeout in seconds for every request the shared Supabase client makes
+SUPABASE_TIMEOUT = 30.0
+
+# Seconds a read message stays hidden from other reads unless deleted first
+VISIBILITY_TIMEOUT = 30
+
+
+@functools.lru_cache(maxsize=None)
+def get_supabase_client() -> Client:
+    """
+    Return the Supabase client shared by every caller in this process.
+    
+    The client is created on first use from the SUPABASE_URL and SUPABASE_KEY
+    environment variables. It sends all its requests through one HTTP/2
+    httpx client, so queue and table operations share one connection pool
+    and reuse kept-alive connections instead of repeating TLS handshakes.
+    
+    Returns:
+        The shared Supabase client
+    """
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32),
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT)
+    )
+    return create_client(
+        os.getenv("SUPABASE_URL"),
+        os.getenv("SUPABASE_KEY"),
+        options=ClientOptions(
+            schema='public',
+            httpx_client=http_client,
+            postgrest_client_timeout=SUPABASE_TIMEOUT
+        )
+    )
+
 
 class SupabaseQueue:
     """
@@ -67,28 +105,35 @@ class SupabaseQueue:
         supabase (Client): Initialized Supabase client for database operations
     """
     
-    def __init__(self):
+    __slots__ = ('supabase',)
+    
+    def __init__(self, client: Optional[Client] = None):
         """
-        Initialize Supabase client using environment variables.
+        Initialize the queue with a Supabase client.
+        
+        Args:
+            client: Supabase client to use (default: the shared client from
+                get_supabase_client)
         
         Raises:
             KeyError: If required environment variables are not set
         """
-        self.supabase: Client = create_client(
-            os.getenv("SUPABASE_URL"),
-            os.getenv("SUPABASE_KEY")
-        )
+        self.supabase: Client = client or get_supabase_client()
 
     def process_batch(self, queue_name: str, batch_size: int = 10) -> List[Dict[str, Any]]:
         """
         Process multiple messages from the queue in a batch.
         
+        The messages are read and removed from the queue with a single
+        database call.
+        
         Args:
             queue_name: Name of the queue to process
             batch_size: Maximum number of messages to retrieve (default: 10)
             
         Returns:
-            List of dequeued messages. May be empty if queue is empty.
+            List of (msg_id, message) tuples for the dequeued messages. May be
+            empty if queue is empty.
             
         Example:
             ```python
@@ -100,18 +145,15 @@ class SupabaseQueue:
                     queue.move_to_dlq('email_queue', msg, str(e))
             ```
         """
-        messages = []
-        for _ in range(batch_size):
-            message = self.dequeue(queue_name)
-            if not message:
-                break
-            messages.append(message)
-        return messages
+        return self.dequeue_batch(queue_name, batch_size)
 
     def get_queue_status(self, queue_name: str) -> Dict[str, bool]:
         """
         Get the current status of a queue and its associated dead-letter queue.
         
+        Both queues are checked with a single database call. Unlike peek, this
+        doesn't read any message, so it leaves them visible to consumers.
+        
         Args:
             queue_name: Name of the queue to check
             
@@ -127,11 +169,15 @@ class SupabaseQueue:
                 print("There are failed messages to process")
             ```
         """
-        msg_id,main_queue = self.peek(queue_name)
-        dmsg_id,dlq = self.peek(f"{queue_name}_dlq")
+        try:
+            result = self.supabase.rpc('queue_status', {'queue_name': queue_name}).execute()
+            status = result.data or {}
+        except Exception as e:
+            print(f"Error getting queue status: {e}",queue_name)
+            status = {}
         return {
-            'has_messages': main_queue is not None,
-            'has_failed_messages': dlq is not None
+            'has_messages': bool(status.get('has_messages')),
+            'has_failed_messages': bool(status.get('has_failed_messages'))
         }
 
     def move_to_dlq(self, queue_name: str, message: Dict[str, Any], error: str):
@@ -190,13 +236,49 @@ class SupabaseQueue:
                 'enqueue',
                 {
                     'queue_name': queue_name,
-                    'message_payload': json.dumps(message)
+                    'message_payload': orjson.dumps(message).decode()
                 }
             ).execute()
         except Exception as e:
             print(f"Error enqueueing message: {e}")
             raise
 
+    def enqueue_batch(self, queue_name: str, messages: List[Dict[str, Any]]) -> None:
+        """
+        Add several messages to the specified queue in one call.
+        
+        The messages are serialized the same way as by enqueue and sent in a single
+        database transaction, so either all of them are queued or none are.
+        
+        Args:
+            queue_name: Name of the queue
+            messages: Dictionaries containing message data, in queue order
+            
+        Raises:
+            Exception: If the enqueue operation fails
+            
+        Example:
+            ```python
+            queue.enqueue_batch('email_queue', [
+                {'subject': 'First'},
+                {'subject': 'Second'}
+            ])
+            ```
+        """
+        if not messages:
+            return
+        try:
+            self.supabase.rpc(
+                'enqueue_batch',
+                {
+                    'queue_name': queue_name,
+                    'message_payloads': [orjson.dumps(message).decode() for message in messages]
+                }
+            ).execute()
+        except Exception as e:
+            print(f"Error enqueueing messages: {e}")
+            raise
+
     def dequeue(self, queue_name: str,msg_id:str=None) -> Optional[Dict[str, Any]]:
         """
         Remove and return the next message from the queue.
@@ -236,6 +318,83 @@ class SupabaseQueue:
             print(f"Error dequeuing message: {e}")
             return None,None
 
+    def dequeue_batch(self, queue_name: str, n: int) -> List[Any]:
+        """
+        Remove and return up to n of the next messages from the queue.
+        
+        The messages are read and deleted in a single atomic operation.
+        
+        Args:
+            queue_name: Name of the queue
+            n: Maximum number of messages to dequeue
+            
+        Returns:
+            List of (msg_id, message) tuples in queue order, empty if the queue
+            is empty or dequeuing fails
+            
+        Example:
+            ```python
+            for msg_id, message in queue.dequeue_batch('email_queue', 10):
+                process_message(message)
+            ```
+        """
+        try:
+            result = self.supabase.rpc('dequeue_batch', {'queue_name': queue_name, 'n': n}).execute()
+            return [(row['msg_id'], orjson.loads(row['data'])) for row in result.data or []]
+        except Exception as e:
+            print(f"Error dequeuing messages: {e}")
+            return []
+
+    def read_batch(self, queue_name: str, n: int, vt: int = VISIBILITY_TIMEOUT) -> List[Any]:
+        """
+        Read up to n of the next messages without removing them from the queue.
+        
+        The messages are read with a single database call and stay hidden from
+        other reads for vt seconds, so concurrent consumers get different
+        messages. Delete them with delete_batch once they are processed.
+        
+        Args:
+            queue_name: Name of the queue
+            n: Maximum number of messages to read
+            vt: Seconds the messages stay hidden (default: VISIBILITY_TIMEOUT)
+            
+        Returns:
+            List of (msg_id, message) tuples in queue order, empty if the queue
+            is empty or reading fails
+            
+        Example:
+            ```python
+            messages = queue.read_batch('email_queue', 10)
+            queue.delete_batch('email_queue', [msg_id for msg_id, _ in messages])
+            ```
+        """
+        try:
+            result = self.supabase.rpc('read_messages', {'queue_name': queue_name, 'vt': vt, 'qty': n}).execute()
+            return [(row['msg_id'], orjson.loads(row['data'])) for row in result.data or []]
+        except Exception as e:
+            print(f"Error reading messages: {e}")
+            return []
+
+    def delete_batch(self, queue_name: str, msg_ids: List[int]) -> bool:
+        """
+        Delete several messages from the queue with a single database call.
+        
+        Args:
+            queue_name: Name of the queue
+            msg_ids: IDs of the messages to delete
+            
+        Returns:
+            True if the messages were deleted, False if deleting failed
+        """
+        if not msg_ids:
+            return True
+        try:
+            self.supabase.rpc('delete_messages', {'queue_name': queue_name, 'msg_ids': list(msg_ids)}).execute()
+            return True
+        except Exception as e:
+            print(f"Error deleting messages: {e}")
+            return False
+
     def peek(self, queue_name: str) -> Optional[Dict[str, Any]]:
         """
         View the next message without removing it from the queue.
@@ -266,7 +425,7 @@ class SupabaseQueue:
             if result.data:
                 j=result.data
                 if j['data']:
-                    return j['msg_id'],json.loads(j['data'])
+                    return j['msg_id'],orjson.loads(j['data'])
             return None,None
         except Exception as e:
             import traceback
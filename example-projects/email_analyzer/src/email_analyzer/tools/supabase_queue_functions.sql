@@ -36,6 +36,25 @@ begin
 end;
 $$;
 
+-- Create a function to enqueue several messages in one transaction
+create or replace function public.enqueue_batch(
+    queue_name text,
+    message_payloads jsonb
+)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    -- Each array element is one message, stored the same way as by enqueue
+    perform pgmq.send_batch(
+        queue_name,
+        array(select value from jsonb_array_elements(message_payloads))
+    );
+end;
+$$;
+
 
 CREATE TYPE my_tuple AS (
     msg_id bigint,
@@ -81,6 +100,65 @@ begin
 end;
 $$;
 
+-- Create a function to dequeue several messages in one transaction
+create or replace function public.dequeue_batch(
+    queue_name text,
+    n integer
+)
+RETURNS setof my_tuple
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    messages my_tuple[];
+begin
+    -- Read up to n messages, then delete them before returning them
+    select coalesce(array_agg((r.msg_id, r.message)::my_tuple order by r.msg_id), '{}')
+    into messages
+    from pgmq.read(queue_name, 30, n) r;
+
+    perform pgmq.delete(queue_name, array(select m.msg_id from unnest(messages) m));
+
+    return query select * from unnest(messages);
+end;
+$$;
+
+-- Create a function to read several messages without removing them; they stay
+-- hidden from other reads for vt seconds
+create or replace function public.read_messages(
+    queue_name text,
+    vt integer,
+    qty integer
+)
+RETURNS setof my_tuple
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    return query
+    select r.msg_id, r.message
+    from pgmq.read(queue_name, vt, qty) r
+    order by r.msg_id;
+end;
+$$;
+
+-- Create a function to delete several messages in one call
+create or replace function public.delete_messages(
+    queue_name text,
+    msg_ids bigint[]
+)
+returns void
+language plpgsql
+security definer
+set search_path = public
+as $$
+begin
+    perform pgmq.delete(queue_name, msg_ids);
+end;
+$$;
+
 drop function peek_queue;
 
 
@@ -120,6 +198,41 @@ $$;
 
 
 
+-- Create a function to check a queue and its dead-letter queue in one call
+create or replace function public.queue_status(
+    queue_name text
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    main_table text := 'q_' || queue_name;
+    dlq_table text := 'q_' || queue_name || '_dlq';
+    has_messages boolean := false;
+    has_failed_messages boolean := false;
+begin
+    -- Only visible messages count, as with peek_queue; nothing is read, so
+    -- the messages stay visible. A queue that doesn't exist yet is empty.
+    if to_regclass(format('pgmq.%I', main_table)) is not null then
+        execute format('select exists(select 1 from pgmq.%I where vt <= clock_timestamp())', main_table)
+        into has_messages;
+    end if;
+
+    if to_regclass(format('pgmq.%I', dlq_table)) is not null then
+        execute format('select exists(select 1 from pgmq.%I where vt <= clock_timestamp())', dlq_table)
+        into has_failed_messages;
+    end if;
+
+    return jsonb_build_object(
+        'has_messages', has_messages,
+        'has_failed_messages', has_failed_messages
+    );
+end;
+$$;
+
+
 -- Create a function to purge a queue
 create or replace function public.purge_queue(
     queue_name text
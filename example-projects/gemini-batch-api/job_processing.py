@@ -1,6 +1,7 @@
 
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from google import genai
 from google.genai.types import CreateBatchJobConfig, JobState, HttpOptions,BatchJob
@@ -14,6 +15,9 @@ from google.oauth2 import service_account
 
 project_id=os.getenv("PROJECT_ID")
 
+# Number of output files downloaded from GCS at the same time
+DOWNLOAD_WORKERS = 32
+
 credentials_path=os.getenv("SERVICE_ACCOUNT_CREDENTIALS")
 
 
@@ -66,7 +70,7 @@ def read_output_file(output_uri: str,credentials=None) -> dict:
             dict: Mapping of input queries to their corresponding responses
         """
         from google.cloud import storage
-        import json
+        import orjson
         
         results = []
         client = storage.Client(credentials=credentials)
@@ -80,31 +84,46 @@ def read_output_file(output_uri: str,credentials=None) -> dict:
         bucket = client.get_bucket(bucket_name)
         blobs = bucket.list_blobs(prefix=prefix)
         
-        for blob in blobs:
-            print("blobs",blob)
-            if not blob.name.endswith('.jsonl'):
-                continue
-                
-            content = blob.download_as_string()
-            for line in content.decode('utf-8').splitlines():
-                response = json.loads(line)
-                query = response['request']['contents'][0]['parts'][0]['text']
-                answer = response['response']['candidates'][0]['content']['parts'][0]['text']
-                results.append({"query":query , "answer":answer })
+        output_blobs = [blob for blob in blobs if blob.name.endswith('.jsonl')]
+        print("blobs",output_blobs)
+        
+        def read_blob(blob):
+            # Stream the file and parse it a line at a time instead of holding
+            # the whole download, and a decoded copy of it, in memory
+            blob_results = []
+            with blob.open('rb') as fh:
+                for raw in fh:
+                    if not raw.strip():
+                        continue
+                    response = orjson.loads(raw)
+                    query = response['request']['contents'][0]['parts'][0]['text']
+                    answer = response['response']['candidates'][0]['content']['parts'][0]['text']
+                    blob_results.append({"query":query , "answer":answer })
+            return blob_results
+        
+        # Read the output files in parallel; results keep the listing order
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            for blob_results in executor.map(read_blob, output_blobs):
+                results.extend(blob_results)
                 
         return results
 
-def wait_for_job_completion(client, job_name: str, interval: int = 5) -> JobState:
+def wait_for_job_completion(client, job_name: str, interval: float = 1.0, max_interval: float = 60.0) -> JobState:
     """
     Waits for a batch job to complete and returns final state.
     
+    The job is checked again after interval seconds, and the wait grows
+    exponentially up to max_interval, so short jobs are noticed quickly and
+    long ones aren't polled needlessly often.
+    
     Args:
         client: Initialized Gemini client
         job_name: Name or ID of the batch job
-        interval: Sleep interval between checks in seconds
+        interval: Sleep interval before the first check in seconds
+        max_interval: Longest sleep interval between checks in seconds
         
     Returns:
-        JobState: Final state of the completed job
+        JobState: Final state of the completed job, and the completed job
     """
     completed_states = {
         JobState.JOB_STATE_SUCCEEDED,
@@ -115,10 +134,12 @@ def wait_for_job_completion(client, job_name: str, interval: int = 5) -> JobStat
     
     job = fetch_job(client, job_name)
     current_state = job.state 
+    delay = interval
     while current_state not in completed_states:
-        time.sleep(interval)
-        current_job = fetch_job(client, job_name)
-        current_state=current_job.state
+        time.sleep(delay)
+        delay = min(delay * 1.7, max_interval)
+        job = fetch_job(client, job_name)
+        current_state=job.state
         print(f"Job state: {current_state}")
         
     print(job,job.dest.gcs_uri)
@@ -134,26 +155,29 @@ def list_jobs(client):
         print(job)
 
 
-credentials = service_account.Credentials.from_service_account_file(
-        credentials_path,
-        scopes=['https://www.googleapis.com/auth/cloud-platform']
-    )
+def main():
+    credentials = service_account.Credentials.from_service_account_file(
+            credentials_path,
+            scopes=['https://www.googleapis.com/auth/cloud-platform']
+        )
 
-# Create and monitor batch job
-client = genai.Client(
-        project=project_id,
-        location="us-central1",
-        credentials=credentials,
-        vertexai=True, 
-        http_options=types.HttpOptions(api_version='v1'))
+    # Create and monitor batch job
+    client = genai.Client(
+            project=project_id,
+            location="us-central1",
+            credentials=credentials,
+            vertexai=True, 
+            http_options=types.HttpOptions(api_version='v1'))
 
+    job_name="1234489749108686848"
+    final_state,job = wait_for_job_completion(client, job_name)
+    output_uri=get_output_uri_from_job(job)
 
+    result=read_output_file(output_uri,credentials)
 
-job_name="1234489749108686848"
-final_state,job = wait_for_job_completion(client, job_name)
-output_uri=get_output_uri_from_job(job)
+    print("result , ",result)
+    print(f"Job completed with final state: {final_state}")
 
-result=read_output_file(output_uri,credentials)
 
-print("result , ",result)
-print(f"Job completed with final state: {final_state}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()